@@ -1,11 +1,11 @@
 from database import get_db
 from calculator import find_best_rate
 from scraper import fetch_all_rates
+from metrics import timed, DB_QUERY_SECONDS
 import logging
 from datetime import datetime
 
-logging.basicConfig(level=logging.INFO)
-
+@timed(DB_QUERY_SECONDS)
 def create_alert(user_id, user_name, target_rate, condition='above'):
     """
     Create a rate alert for a user.
@@ -58,6 +58,7 @@ def create_alert(user_id, user_name, target_rate, condition='above'):
                 'message': f'✅ 已设置预警: 当汇率高于 {target_rate:.4f} 时提醒您\n\n输入 "取消预警" 可关闭通知'
             }
 
+@timed(DB_QUERY_SECONDS)
 def cancel_alert(user_id):
     """Cancel active alerts for a user."""
     with get_db() as conn:
@@ -83,6 +84,7 @@ def cancel_alert(user_id):
                 'message': '您目前没有活跃的汇率预警'
             }
 
+@timed(DB_QUERY_SECONDS)
 def get_user_alerts(user_id):
     """Get active alerts for a user."""
     with get_db() as conn:
@@ -95,15 +97,19 @@ def get_user_alerts(user_id):
         
         return [dict(row) for row in cursor.fetchall()]
 
-def check_alerts_and_notify():
+def check_alerts_and_notify(current_rates=None):
     """
     Background task: Check current rates against all active alerts.
     Returns list of users to notify with their alert details.
     
     This should be called periodically (e.g., every 30 minutes).
+    
+    Args:
+        current_rates: Rates to check against (optional, fetched fresh if omitted)
     """
     # Fetch current rates
-    current_rates = fetch_all_rates()
+    if current_rates is None:
+        current_rates = fetch_all_rates()
     best_rate = find_best_rate(current_rates, 'buying_tt')
     
     if not best_rate:
@@ -114,7 +120,8 @@ def check_alerts_and_notify():
     
     notifications = []
     
-    with get_db() as conn:
+    # Timed here rather than as a whole: the optional fetch above is network time
+    with DB_QUERY_SECONDS.time('check_alerts_and_notify'), get_db() as conn:
         cursor = conn.cursor()
         
         # Get all active alerts
@@ -129,7 +136,16 @@ def check_alerts_and_notify():
             elif alert['condition'] == 'below' and current_best_rate <= alert['target_rate']:
                 should_notify = True
             
-            if should_notify:
+            if not should_notify:
+                continue
+            
+            # Claim the alert: another worker (or a request thread) may be checking it too
+            cursor.execute('''
+                UPDATE alerts
+                SET active = 0, triggered_at = ?
+                WHERE alert_id = ? AND active = 1
+            ''', (datetime.now(), alert['alert_id']))
+            if cursor.rowcount == 1:
                 notifications.append({
                     'user_id': alert['user_id'],
                     'user_name': alert['user_name'],
@@ -142,13 +158,6 @@ def check_alerts_and_notify():
                               f"提供方: {best_rate['provider']}\n\n"
                               f"现在是兑换的好时机! 💰"
                 })
-                
-                # Mark alert as triggered
-                cursor.execute('''
-                    UPDATE alerts
-                    SET active = 0, triggered_at = ?
-                    WHERE alert_id = ?
-                ''', (datetime.now(), alert['alert_id']))
         
         conn.commit()
     
@@ -156,6 +165,9 @@ def check_alerts_and_notify():
     return notifications
 
 if __name__ == "__main__":
+    from log_config import configure_logging
+    configure_logging()
+    
     from database import init_database
     init_database()
     
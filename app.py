@@ -1,78 +1,233 @@
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
+from flask import Flask, request, abort, Response
+from linebot import LineBotApi, WebhookParser
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
+from linebot.models import MessageEvent, TextMessage
 from apscheduler.schedulers.background import BackgroundScheduler
+import hmac
 import logging
-import re
+import threading
+import time
+from datetime import datetime, timedelta
 
 # Import our modules
 from scraper import fetch_all_rates
-from calculator import get_exchange_summary, format_all_rates_table
-from database import init_database, save_rate_history, is_admin
+from calculator import render_exchange_summary, render_rates_table, render_trend
+from database import init_database, save_rate_history, get_rate_history, get_admin_ids, is_admin
+from support import record_support_request, get_support_request_content, attach_delivery, get_recent_support_requests
 from queue_manager import join_queue, get_queue_status, get_next_customer, mark_completed, get_full_queue, leave_queue
 from alerts import create_alert, cancel_alert, check_alerts_and_notify
-from custom_rate import get_custom_rate, set_custom_rate, auto_set_from_ref
+from custom_rate import get_custom_rate, set_custom_rate, set_rate_tiers, auto_set_from_ref, sync_from_rates, on_custom_rate_change, REFERENCE_PROVIDER
+from rate_stats import RateStatistics, MIN_SAMPLES
+from quote_history import QuoteHistory
+from snapshot import get_snapshot, sync_with_store, publish, replace_custom_rate, warm_start
+from response_cache import ResponseCache
+from pricing import parse_tiers, format_tiers
+from event_worker import EventWorkerPool
+from profile_cache import ProfileCache
+from router import CommandRouter
+from leader import LeaderElection, LeaderLock
+from log_config import configure_logging, log_event, sampled, RateLimiter
+from line_client import PooledHttpClient
+from messaging import Messenger
+import profiler
+from metrics import timed, render as render_metrics, Gauge, COMMAND_SECONDS, JOB_SECONDS
+import rates_api
+from rate_stream import RateStream
+from quotes import MAX_BATCH_SIZE, QuoteError, parse_amounts, price_sheet_amounts, build_quotes, quotes_to_dict, quotes_to_csv
 import config
 
 # Initialize Flask app
 app = Flask(__name__)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (queued, structured; see log_config)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# The "set ADMIN_USER_IDS" hint is logged at most once per user per 10 minutes
+admin_hint_limiter = RateLimiter(600)
+
 # Initialize LINE Bot API
-line_bot_api = LineBotApi(config.LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(config.LINE_CHANNEL_SECRET)
+line_bot_api = LineBotApi(config.LINE_CHANNEL_ACCESS_TOKEN, endpoint=config.LINE_API_ENDPOINT, http_client=PooledHttpClient)
+parser = WebhookParser(config.LINE_CHANNEL_SECRET)
 
 # Initialize database
 init_database()
 
-# Global variable to store latest rates
-latest_rates = []
+# Serve the last persisted rates (marked stale) until the first refresh lands
+warm_start()
+
+# Recent quotes per provider in memory, seeded from history and fed by every new snapshot.
+# Sized for the fastest refresh cadence (on-demand refreshes every RATE_SOFT_TTL at most).
+_refresh_seconds = min(config.RATE_UPDATE_INTERVAL * 60, config.RATE_SOFT_TTL or float('inf'))
+quote_history = QuoteHistory(
+    capacity=int(config.QUOTE_HISTORY_DAYS * 86400 / _refresh_seconds) + 1,
+    days=config.QUOTE_HISTORY_DAYS
+)
+
+# Rolling statistics per provider, updated with every quote added to quote_history.
+# Window and EWMA span are in time; capacity fits the window at the fastest cadence.
+rate_stats = RateStatistics(
+    seconds=config.RATE_STATS_DAYS * 86400,
+    ewma_seconds=config.RATE_STATS_EWMA_HOURS * 3600,
+    capacity=max(MIN_SAMPLES, int(config.RATE_STATS_DAYS * 86400 / _refresh_seconds) + 1)
+)
+quote_history.on_quote(rate_stats.add)
+quote_history.seed(get_rate_history, get_snapshot())
+
+# Outbound messages: replies sent directly, pushes through the persistent outbox
+messenger = Messenger(
+    line_bot_api,
+    rate=config.LINE_API_RATE,
+    workers=config.OUTBOX_WORKERS,
+    max_attempts=config.OUTBOX_MAX_ATTEMPTS
+)
+
+# Display names, fetched lazily by the commands that need them
+profile_cache = ProfileCache(maxsize=config.PROFILE_CACHE_SIZE, ttl=config.PROFILE_CACHE_TTL)
+
+# Rendered rate/calculation replies, invalidated by snapshot and custom-rate versions
+response_cache = ResponseCache()
 
+@profiler.profiled
 def update_rates():
-    """Background task to update exchange rates."""
-    global latest_rates
+    """Background task to update exchange rates and publish a new snapshot."""
     try:
         logger.info("Updating exchange rates...")
-        latest_rates = fetch_all_rates()
-        save_rate_history(latest_rates)
-        logger.info(f"Successfully updated {len(latest_rates)} rates")
+        rates = fetch_all_rates()
+        save_rate_history(rates)
+        snapshot = publish(rates, get_custom_rate())
+        quote_history.sync(snapshot, get_rate_history)
+        logger.info(f"Successfully updated {len(rates)} rates (snapshot v{snapshot.version})")
     except Exception as e:
         logger.error(f"Error updating rates: {e}")
+        return
+    
+    if config.AUTO_SYNC_CUSTOM_RATE:
+        sync_custom_rate()
+
+# One rate refresh at a time per host: a thread lock in this process, a lock file across workers
+_refresh_lock = threading.Lock()
+_refresh_file_lock = LeaderLock(config.REFRESH_LOCK_FILE)
+
+def refresh_rates(max_age=None):
+    """
+    Run update_rates() unless a refresh is already running in this or another worker.
+    With max_age, also skip if another worker published rates younger than that meanwhile.
+
+    Returns:
+        True if this call refreshed the rates
+    """
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+    try:
+        if not _refresh_file_lock.try_acquire():
+            return False
+        try:
+            if max_age is not None and sync_with_store().age() < max_age:
+                return False
+            update_rates()
+            return True
+        finally:
+            _refresh_file_lock.release()
+    finally:
+        _refresh_lock.release()
+
+# Minimum seconds between on-demand refresh attempts, so a provider outage is not hammered
+ON_DEMAND_REFRESH_COOLDOWN = 60
+_last_on_demand_refresh = float('-inf')
+
+def current_snapshot():
+    """
+    get_snapshot() for user requests (stale-while-revalidate).
+    Rates older than RATE_SOFT_TTL are served as they are while one background refresh runs.
+    """
+    global _last_on_demand_refresh
+    snapshot = get_snapshot()
+    if (config.RATE_SOFT_TTL > 0 and config.SCHEDULER_MODE != 'off'
+            and snapshot.age() > config.RATE_SOFT_TTL
+            and not _refresh_lock.locked()
+            and time.monotonic() - _last_on_demand_refresh >= ON_DEMAND_REFRESH_COOLDOWN):
+        _last_on_demand_refresh = time.monotonic()
+        logger.info(f"Rates are {snapshot.age():.0f}s old, refreshing in the background")
+        threading.Thread(
+            target=refresh_rates, kwargs={'max_age': config.RATE_SOFT_TTL},
+            name='rate-refresh', daemon=True
+        ).start()
+    return snapshot
+
+def sync_custom_rate():
+    """Pipeline stage: keep the custom rate in step with the BOC TH reference."""
+    try:
+        result = sync_from_rates(get_snapshot().by_provider)
+        if result:
+            logger.info(f"Auto-synced custom rate to {result['buying_tt']:.2f} (v{result['version']})")
+    except Exception as e:
+        logger.error(f"Error syncing custom rate: {e}")
 
-def check_and_send_alerts():
-    """Background task to check alerts and send notifications."""
+@on_custom_rate_change
+def handle_custom_rate_changed(rate_data):
+    """
+    Publish the new custom rate and re-check alerts, only when it changed.
+    The check runs after the admin's reply has been sent (at once from background jobs).
+    """
+    snapshot = replace_custom_rate(rate_data)
+    if not snapshot.is_empty():
+        after_reply(lambda: check_and_send_alerts(snapshot.rates))
+
+@profiler.profiled
+def check_and_send_alerts(market_rates=None):
+    """
+    Background task to check alerts and send notifications.
+    Alerts are always checked against market rates plus the current custom rate.
+    
+    Args:
+        market_rates: Market rates to check (optional, the published snapshot's if omitted)
+    """
     try:
         logger.info("Checking rate alerts...")
-        notifications = check_alerts_and_notify()
+        if market_rates is None:
+            market_rates = get_snapshot().rates
+        current_rates = [r for r in market_rates if r.get('status') != 'custom']
+        custom_rate = get_custom_rate()
+        if custom_rate:
+            current_rates.append(custom_rate)
+        notifications = check_alerts_and_notify(current_rates)
         
         for notif in notifications:
             try:
-                line_bot_api.push_message(
-                    notif['user_id'],
-                    TextSendMessage(text=notif['message'])
-                )
-                logger.info(f"Sent alert to {notif['user_name']}")
+                messenger.push(notif['user_id'], notif['message'])
+                logger.info(f"Queued alert for {notif['user_name']}")
             except Exception as e:
-                logger.error(f"Failed to send alert to {notif['user_id']}: {e}")
+                logger.error(f"Failed to queue alert for {notif['user_id']}: {e}")
                 
     except Exception as e:
         logger.error(f"Error checking alerts: {e}")
 
-# Initialize scheduler for background tasks
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=update_rates, trigger="interval", minutes=config.RATE_UPDATE_INTERVAL)
-scheduler.add_job(func=check_and_send_alerts, trigger="interval", minutes=config.ALERT_CHECK_INTERVAL)
-scheduler.start()
+# Initialize scheduler for background tasks (job run times are exported on /metrics)
+rates_job = timed(JOB_SECONDS, 'refresh_rates')(refresh_rates)
+alerts_job = timed(JOB_SECONDS, 'check_alerts')(check_and_send_alerts)
 
-# Initial rate fetch
-update_rates()
+scheduler = BackgroundScheduler()
+scheduler.add_job(func=rates_job, trigger="interval", minutes=config.RATE_UPDATE_INTERVAL)
+scheduler.add_job(func=alerts_job, trigger="interval", minutes=config.ALERT_CHECK_INTERVAL)
+
+def start_background_jobs():
+    """Run by the elected leader only: start the scheduler and outbox delivery, fetch rates once."""
+    scheduler.start()
+    messenger.start()
+    
+    # Initial rate fetch runs on the scheduler's thread so startup never waits on providers
+    scheduler.add_job(func=rates_job, id='initial_rate_fetch')
+
+# Background jobs run in exactly one process per host: whoever holds the lock file.
+# Other workers serve the rates it publishes and take over if it dies.
+scheduler_election = LeaderElection(
+    config.SCHEDULER_LOCK_FILE,
+    on_elected=start_background_jobs,
+    retry_seconds=config.SCHEDULER_RETRY_SECONDS
+)
+if config.SCHEDULER_MODE == 'auto':
+    scheduler_election.start()
 
 @app.route("/callback", methods=['POST'])
 def callback():
@@ -80,14 +235,8 @@ def callback():
     signature = request.headers.get('X-Line-Signature', '')
     body = request.get_data(as_text=True)
     
-    logger.info("="*60)
-    logger.info("✅ Received webhook request")
-    logger.info(f"Signature: {signature[:20]}...")
-    logger.info(f"Body length: {len(body)}")
-    logger.info("="*60)
-    
     try:
-        handler.handle(body, signature)
+        events = parser.parse(body, signature)
     except InvalidSignatureError:
         logger.error("Invalid signature. Please check your LINE_CHANNEL_SECRET.")
         abort(400)
@@ -95,141 +244,241 @@ def callback():
         logger.error(f"Webhook error: {e}", exc_info=True)
         abort(500)
     
+    if sampled():
+        log_event(logger, 'webhook_received', body_length=len(body), events=len(events))
+    
+    # Acknowledge right away; replies are sent from the worker pool
+    if events and not event_pool.submit(events):
+        logger.error("Webhook queue full, asking LINE to redeliver")
+        abort(503)
+    
     return 'OK'
 
-@handler.add(MessageEvent, message=TextMessage)
+def process_events(events):
+    """Worker pool task: dispatch the events from one webhook request."""
+    for event in events:
+        try:
+            if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+                handle_message(event)
+        except Exception as e:
+            logger.error(f"Error handling {event.type} event: {e}", exc_info=True)
+
+# Bounded worker pool for webhook events
+event_pool = EventWorkerPool(
+    process_events,
+    workers=config.WEBHOOK_WORKERS,
+    max_queue=config.WEBHOOK_QUEUE_SIZE
+)
+event_pool.start()
+
+def send_reply(event, text):
+    """
+    Reply to an event, falling back to a push message if the reply token
+    has probably expired while the event was queued, or the reply fails.
+    """
+    age = time.time() - event.timestamp / 1000
+    if age < config.REPLY_TOKEN_TTL:
+        messenger.reply(event.reply_token, text, fallback_to=event.source.sender_id)
+    else:
+        logger.warning(f"Reply token expired ({age:.0f}s old), pushing instead")
+        messenger.push(event.source.sender_id, text)
+
+@profiler.profiled
 def handle_message(event):
     """Handle incoming text messages."""
     user_id = event.source.user_id
     text = event.message.text.strip()
     
-    try:
-        # Get user profile
-        profile = line_bot_api.get_profile(user_id)
-        user_name = profile.display_name
-    except:
-        user_name = "User"
-    
     # Detect source type (User, Group, Room)
     source_type = event.source.type
     group_id = event.source.group_id if source_type == 'group' else None
     
-    # 🔥 重要: 打印 USER ID & 来源 供管理员配置使用
-    logger.info("="*60)
-    logger.info(f"📨 收到消息 [{'群聊' if source_type == 'group' else '私聊'}]")
-    if group_id:
-        logger.info(f"👥 Group ID: {group_id}")
-    logger.info(f"👤 用户名: {user_name}")
-    logger.info(f"🆔 USER ID: {user_id}")
-    logger.info(f"💬 消息内容: {text}")
-    logger.info("="*60)
+    # 打印 USER ID & 来源 供管理员配置使用 (sampled; message text only at DEBUG)
+    if sampled():
+        log_event(logger, 'message_received', source=source_type, user_id=user_id,
+                  group_id=group_id, text_length=len(text))
+    log_event(logger, 'message_text', logging.DEBUG, user_id=user_id, text=text)
     
     # 如果.env中ADMIN_USER_IDS为空,提示用户
-    if not config.ADMIN_USER_IDS or config.ADMIN_USER_IDS == ['']:
-        logger.warning("⚠️  ADMIN_USER_IDS 未设置!")
-        logger.warning(f"⚠️  请将以下 USER ID 添加到 .env 文件:")
-        logger.warning(f"⚠️  ADMIN_USER_IDS={user_id}")
+    if (not config.ADMIN_USER_IDS or config.ADMIN_USER_IDS == ['']) and admin_hint_limiter.allow(user_id):
+        log_event(logger, 'admin_user_ids_not_set', logging.WARNING, user_id=user_id,
+                  hint=f"ADMIN_USER_IDS={user_id}")
     
-    # Command routing
-    response = route_command(user_id, user_name, text)
+    # Command routing (the display name is looked up only if a command needs it)
+    _after_reply.tasks = []
+    try:
+        response = route_command(user_id, None, text)
+        send_reply(event, response)
+    finally:
+        tasks, _after_reply.tasks = _after_reply.tasks, None
     
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text=response)
-    )
+    for task in tasks:
+        try:
+            task()
+        except Exception as e:
+            logger.error(f"After-reply task failed: {e}", exc_info=True)
 
-def route_command(user_id, user_name, text):
-    """Route user commands to appropriate handlers."""
+# Work a handler defers until its reply has been sent (per worker thread)
+_after_reply = threading.local()
+
+def after_reply(task):
+    """Run task once the current message has been answered (immediately outside handle_message)."""
+    tasks = getattr(_after_reply, 'tasks', None)
+    if tasks is None:
+        task()
+    else:
+        tasks.append(task)
+
+def get_user_name(user_id, user_name=None):
+    """Display name for a user, from the caller if known, else the profile cache."""
+    if user_name:
+        return user_name
+    return profile_cache.get(user_id, lambda: line_bot_api.get_profile(user_id).display_name)
+
+def support_content(text):
+    """Extract the question from a human support message."""
     text_lower = text.lower()
-    
-    # Rate display commands
-    if text_lower in ['汇率', 'rate', 'rates', '查汇率']:
-        return handle_rate_display()
-    
-    # Calculation commands
-    calc_match = re.match(r'(计算|calc|calculate)\s*(\d+\.?\d*)', text_lower)
-    if calc_match:
-        amount = float(calc_match.group(2))
-        return handle_calculation(amount)
-    
-    # Queue commands
-    if text_lower in ['排队', 'queue', 'join']:
-        return handle_join_queue(user_id, user_name)
-    
-    if text_lower in ['位置', 'status', 'position', '我的位置']:
-        return handle_queue_status(user_id)
-    
-    if text_lower in ['离开', 'leave', '退出排队']:
-        return handle_leave_queue(user_id)
-    
-    # Alert commands
-    alert_match = re.match(r'(预警|alert)\s+(\d+\.?\d*)', text_lower)
-    if alert_match:
-        target_rate = float(alert_match.group(2))
-        return handle_create_alert(user_id, user_name, target_rate)
-    
-    if text_lower in ['取消预警', 'cancel alert', 'cancel']:
-        return handle_cancel_alert(user_id)
-    
-    # Human support command
-    if text_lower.startswith(('人工', '客服', '有人吗')):
-        content = text[2:].strip() if text_lower.startswith('人工') else (text[4:].strip() if text_lower.startswith('人工客服') else text)
-        return handle_human_support(user_id, user_name, content)
-    
-    # Admin commands (restricted)
-    if is_admin(user_id) or user_id in config.ADMIN_USER_IDS:
-        # Admin Reply: 回复 {user_id} {message}
-        reply_match = re.match(r'回复\s+([a-zA-Z0-9]+)\s+(.+)', text, re.DOTALL)
-        if reply_match:
-            target_id = reply_match.group(1)
-            msg_content = reply_match.group(2)
-            return handle_admin_reply(target_id, msg_content)
-            
-        # Set custom rate manually
-        set_rate_match = re.match(r'(设置汇率|setrate)\s+(\d+\.?\d*)', text_lower)
-        if set_rate_match:
-            rate_value = float(set_rate_match.group(2))
-            return handle_set_custom_rate(rate_value)
-        
-        # Auto set from BOC TH
-        if text_lower in ['自动设置', 'auto', 'autoset']:
-            return handle_auto_set_rate()
-        
-        # Queue management
-        if text_lower in ['下一个', 'next', '下一位']:
-            return handle_next_customer()
+    if text_lower.startswith('人工'):
+        return text[2:].strip()
+    return text[4:].strip() if text_lower.startswith('人工客服') else text
+
+# Command table. Handlers are called as func(user_id, user_name, text, *groups).
+# Exact keywords are a dict lookup; patterns become one regex, tried in this order.
+router = CommandRouter()
+
+# Rate display and calculation
+router.keywords('rates', ['汇率', 'rate', 'rates', '查汇率'], lambda u, n, t: handle_rate_display())
+router.pattern('calc', r'(?:计算|calc|calculate)\s*(\d+\.?\d*)', lambda u, n, t, amount: handle_calculation(float(amount)))
+router.keywords('trend', ['走势', '趋势', 'trend'], lambda u, n, t: handle_trend())
+
+# Queue
+router.keywords('queue_join', ['排队', 'queue', 'join'], lambda u, n, t: handle_join_queue(u, n))
+router.keywords('queue_status', ['位置', 'status', 'position', '我的位置'], lambda u, n, t: handle_queue_status(u))
+router.keywords('queue_leave', ['离开', 'leave', '退出排队'], lambda u, n, t: handle_leave_queue(u))
+
+# Alerts
+router.pattern('alert', r'(?:预警|alert)\s+(\d+\.?\d*)', lambda u, n, t, rate: handle_create_alert(u, n, float(rate)))
+router.keywords('alert_cancel', ['取消预警', 'cancel alert', 'cancel'], lambda u, n, t: handle_cancel_alert(u))
+
+# Human support
+router.pattern('support', r'(?:人工|客服|有人吗)', lambda u, n, t: handle_human_support(u, n, support_content(t)))
+
+# Admin commands (restricted)
+router.pattern('admin_reply', r'回复\s+([a-zA-Z0-9]+)\s+(.+)', lambda u, n, t, target, msg: handle_admin_reply(target, msg), admin=True)
+router.pattern('set_rate', r'(?:设置汇率|setrate)\s+(\d+\.?\d*)', lambda u, n, t, rate: handle_set_custom_rate(float(rate)), admin=True)
+router.pattern('set_tiers', r'(?:设置阶梯|settiers)\s+(.+)', lambda u, n, t, tiers: handle_set_tiers(tiers), admin=True)
+router.keywords('clear_tiers', ['清除阶梯', 'cleartiers'], lambda u, n, t: handle_clear_tiers(), admin=True)
+router.keywords('auto_set', ['自动设置', 'auto', 'autoset'], lambda u, n, t: handle_auto_set_rate(), admin=True)
+router.keywords('next', ['下一个', 'next', '下一位'], lambda u, n, t: handle_next_customer(), admin=True)
+router.keywords('complete', ['完成', 'done', 'complete'], lambda u, n, t: handle_complete_customer(), admin=True)
+router.keywords('view_queue', ['队列', 'queue list', '查看队列'], lambda u, n, t: handle_view_queue(), admin=True)
+router.keywords('support_log', ['咨询记录', 'support log'], lambda u, n, t: handle_support_log(), admin=True)
+
+router.compile()
+
+@profiler.profiled
+def route_command(user_id, user_name, text):
+    """
+    Route user commands to appropriate handlers.
+    user_name may be None; handlers that need it call get_user_name.
+    """
+    start = time.perf_counter()
+    name = 'help'
+    try:
+        command, args = router.match(text)
         
-        if text_lower in ['完成', 'done', 'complete']:
-            return handle_complete_customer()
+        # Admin rights are checked at most once per message (in-memory set)
+        if command is None or command.admin:
+            admin = is_admin(user_id)
+            if command is None or not admin:
+                # Help / Default
+                return handle_help(admin)
         
-        if text_lower in ['队列', 'queue list', '查看队列']:
-            return handle_view_queue()
-    
-    # Help / Default
-    return handle_help(is_admin(user_id) or user_id in config.ADMIN_USER_IDS)
+        name = command.name
+        return command.func(user_id, user_name, text, *args)
+    finally:
+        COMMAND_SECONDS.observe(time.perf_counter() - start, name)
 
 def handle_rate_display():
     """Display all exchange rates."""
-    if not latest_rates:
+    snapshot = current_snapshot()
+    if snapshot.is_empty():
         return "⏳ 正在获取最新汇率,请稍后..."
     
-    custom_rate = get_custom_rate()
-    return format_all_rates_table(latest_rates, custom_rate)
+    return response_cache.get_or_render(
+        snapshot.version, snapshot.custom_version, 'rates',
+        lambda: with_stale_note(snapshot, render_rates_table(snapshot.display_rates, snapshot.best_buy, snapshot.custom_rate))
+    )
+
+def with_stale_note(snapshot, text):
+    """Prefix a notice when the snapshot was restored at startup and not refreshed yet."""
+    if snapshot.stale:
+        return "⚠️ 汇率正在更新,以下为上次保存的数据,仅供参考\n\n" + text
+    return text
 
 def handle_calculation(amount):
     """Calculate exchange for specified amount."""
-    if not latest_rates:
+    snapshot = current_snapshot()
+    if snapshot.is_empty():
         return "⏳ 正在获取最新汇率,请稍后..."
     
     if amount <= 0:
         return "❌ 请输入有效的金额 (大于0)"
     
-    custom_rate = get_custom_rate()
-    return get_exchange_summary(latest_rates, amount, custom_rate)
+    return response_cache.get_or_render(
+        snapshot.version, snapshot.custom_version, ('calc', amount),
+        lambda: render_calculation(snapshot, amount)
+    )
+
+def render_calculation(snapshot, amount):
+    """Render a calculation, applying the custom rate's amount band if any."""
+    custom_rate = snapshot.custom_rate
+    tier = None
+    if custom_rate and snapshot.tier_table:
+        tier = snapshot.tier_table.resolve(amount)
+        if tier[1] or tier[2]:
+            custom_rate = dict(
+                custom_rate,
+                buying_tt=custom_rate['buying_tt'] + tier[1],
+                selling_tt=custom_rate['selling_tt'] + tier[2]
+            )
+    return with_stale_note(snapshot, render_exchange_summary(
+        snapshot.public_rates, snapshot.best_buy, amount, custom_rate, tier, market_percentile(snapshot)
+    ))
+
+def market_percentile(snapshot):
+    """Percentile rank of the market best in its provider's rolling window, or None if too few samples."""
+    best = snapshot.best_buy
+    if not best:
+        return None
+    quote_history.sync(snapshot, get_rate_history)
+    stats = rate_stats.get(best['provider'])
+    if not stats or stats['samples'] < MIN_SAMPLES:
+        return None
+    return rate_stats.percentile(best['provider'], best['buying_tt'])
+
+def handle_trend():
+    """Rate trend per provider from the rolling statistics (no database reads)."""
+    snapshot = current_snapshot()
+    if snapshot.is_empty():
+        return "⏳ 正在获取最新汇率,请稍后..."
+    
+    return response_cache.get_or_render(
+        snapshot.version, snapshot.custom_version, ('trend',),
+        lambda: render_trend_reply(snapshot)
+    )
+
+def render_trend_reply(snapshot):
+    percentile = market_percentile(snapshot)
+    providers = [rate['provider'] for rate in snapshot.display_rates if rate.get('status') != 'custom']
+    return with_stale_note(snapshot, render_trend(
+        [(provider, rate_stats.get(provider)) for provider in providers],
+        snapshot.best_buy, percentile, config.RATE_STATS_DAYS
+    ))
 
 def handle_join_queue(user_id, user_name):
     """Handle user joining the queue."""
-    result = join_queue(user_id, user_name)
+    result = join_queue(user_id, get_user_name(user_id, user_name))
     
     if result['status'] == 'already_in_queue':
         return f"您已在队列中!\n\n您前面还有 {result['position'] - 1} 人\n\n输入 '位置' 查看实时状态"
@@ -260,7 +509,7 @@ def handle_create_alert(user_id, user_name, target_rate):
     if target_rate < 3.0 or target_rate > 6.0:
         return "❌ 汇率设置不合理 (建议范围: 3.0 - 6.0)"
     
-    result = create_alert(user_id, user_name, target_rate, 'above')
+    result = create_alert(user_id, get_user_name(user_id, user_name), target_rate, 'above')
     return result['message']
 
 def handle_cancel_alert(user_id):
@@ -278,10 +527,7 @@ def handle_next_customer():
     # Notify the customer
     try:
         message = "🔔 轮到您了!\n\n请准备好您的兑换需求,我们即将为您处理。"
-        line_bot_api.push_message(
-            customer['user_id'],
-            TextSendMessage(text=message)
-        )
+        messenger.push(customer['user_id'], message)
     except Exception as e:
         logger.error(f"Failed to notify customer: {e}")
     
@@ -302,46 +548,67 @@ def handle_complete_customer():
     # Notify customer
     try:
         message = "✅ 您的业务已处理完成,感谢您的耐心等待!"
-        line_bot_api.push_message(
-            customer['user_id'],
-            TextSendMessage(text=message)
-        )
+        messenger.push(customer['user_id'], message)
     except Exception as e:
         logger.error(f"Failed to notify customer: {e}")
     
     return f"✅ 已完成: {customer['user_name']}\n\n输入 '下一个' 处理下一位客户"
 
 def handle_human_support(user_id, user_name, content):
-    """Relay user message to all admins."""
+    """Relay user message to all admins (one multicast, sent after the user's reply)."""
     if not content:
         return "请在 '人工' 后面输入您想咨询的内容。例如: 人工 什么时候开门？"
     
+    admin_ids = sorted(get_admin_ids())
+    if not admin_ids:
+        return "❌ 抱歉，目前客服不在线。"
+    
+    request_id, follow_up = record_support_request(user_id, content, config.SUPPORT_DEDUPE_SECONDS)
+    if follow_up:
+        return "✅ 已补充到您的咨询，客服会一并查看，请耐心等待回复"
+    
+    after_reply(lambda: relay_support_request(request_id, user_id, user_name, content, admin_ids))
+    return "✅ 消息已发给人工客服，请稍候..."
+
+def relay_support_request(request_id, user_id, user_name, content, admin_ids):
+    """
+    Queue the support message to all admins as one multicast and record it for tracking.
+    Follow-ups recorded before this runs are sent along with it.
+    """
+    user_name = get_user_name(user_id, user_name)
+    content = get_support_request_content(request_id) or content
     admin_msg = f"📩 **收到人工咨询**\n"
     admin_msg += f"👤 用户: {user_name}\n"
     admin_msg += f"🆔 ID: `{user_id}`\n"
     admin_msg += f"💬 内容: {content}\n\n"
     admin_msg += f"💡 回复指令: 回复 {user_id} [您的内容]"
     
-    success_count = 0
-    for admin_id in config.ADMIN_USER_IDS:
-        if not admin_id: continue
-        try:
-            line_bot_api.push_message(admin_id, TextSendMessage(text=admin_msg))
-            success_count += 1
-        except Exception as e:
-            logger.error(f"Failed to relay message to admin {admin_id}: {e}")
-            
-    if success_count > 0:
-        return "✅ 消息已发给人工客服，请稍候..."
-    else:
-        return "❌ 抱歉，目前客服不在线。"
+    message_id = messenger.multicast(admin_ids, admin_msg)
+    attach_delivery(request_id, message_id)
+    logger.info(f"Support request {request_id} from {user_id} queued to {len(admin_ids)} admins (message {message_id})")
+
+def handle_support_log():
+    """Admin: Recent support requests and whether the relay reached the admins."""
+    requests_log = get_recent_support_requests()
+    if not requests_log:
+        return "暂无人工咨询记录"
+    
+    status_icons = {'sent': '✅', 'failed': '❌', 'pending': '⏳', 'sending': '⏳'}
+    lines = ["📨 最近人工咨询"]
+    for item in requests_log:
+        icon = status_icons.get(item['delivery_status'], '⏳')
+        when = datetime.fromtimestamp(item['created_at']).strftime('%m-%d %H:%M')
+        lines.append(f"\n{icon} {when} {item['user_id']}\n   {item['content'][:40]}")
+        if item['delivery_status'] == 'failed':
+            lines.append(f"   发送失败: {item['last_error']}")
+    return "\n".join(lines)
 
 def handle_admin_reply(target_id, message):
     """Admin replying to a user's consultation."""
     try:
         reply_text = f"👩‍💻 **客服回复**:\n{message}"
-        line_bot_api.push_message(target_id, TextSendMessage(text=reply_text))
-        return f"✅ 已成功回复给用户: {target_id}"
+        messenger.push(target_id, reply_text)
+        return f"✅ 回复已提交,正在发送给用户: {target_id}"
     except Exception as e:
         logger.error(f"Admin reply failed: {e}")
         return f"❌ 回复失败: {e}"
@@ -371,10 +638,30 @@ def handle_set_custom_rate(rate_value):
     
     return f"✅ 已设置优选汇率\n\n买入价: {result['buying_tt']:.2f}\n卖出价: {result['selling_tt']:.2f}\n\n提示: 汇率已自动调整为0.05的倍数"
 
+def handle_set_tiers(tiers_text):
+    """Admin: Set amount-band adjustments for the custom rate."""
+    try:
+        tiers = parse_tiers(tiers_text)
+    except ValueError:
+        return "❌ 格式错误\n\n示例: 设置阶梯 10000:0.02,50000:0.05\n(金额:买入调整[/卖出调整])"
+    
+    result = set_rate_tiers(tiers)
+    if not result:
+        return "❌ 请先设置优选汇率"
+    
+    return f"✅ 已设置阶梯价格\n\n{format_tiers(result['tiers'])}"
+
+def handle_clear_tiers():
+    """Admin: Remove all amount-band adjustments."""
+    result = set_rate_tiers([])
+    if not result:
+        return "❌ 请先设置优选汇率"
+    return "✅ 已清除阶梯价格"
+
 def handle_auto_set_rate():
     """Admin: Auto-set rate from BOC TH."""
     # Find BOC TH rate from latest rates
-    boc_ref = next((r for r in latest_rates if '中国银行(泰国)' in r.get('provider', '')), None)
+    boc_ref = get_snapshot().get_provider(REFERENCE_PROVIDER)
     
     if not boc_ref or boc_ref.get('status') not in ['success', 'fallback']:
         return "❌ 无法获取中国银行(泰国)参考汇率"
@@ -395,6 +682,7 @@ def handle_help(is_admin_user=False):
 📊 **查询汇率**
 • 汇率 - 查看所有对比 (含央行、Google财经)
 • 计算 [金额] - 试算兑换结果 (如: 计算5000)
+• 走势 - 近期汇率走势、区间与波动
 
 📋 **排队功能**
 • 排队 - 加入客户队列
@@ -409,10 +697,13 @@ def handle_help(is_admin_user=False):
 🛠️ **管理员功能**
 • 自动设置 - 根据中行价格自动同步优选价
 • 设置汇率 [数值] - 手动设置优选价格
+• 设置阶梯 [金额:调整,...] - 大额阶梯价 (如: 设置阶梯 10000:0.02)
+• 清除阶梯 - 取消阶梯价格
 • 队列 - 查看当前所有人排队名单
 • 下一个 - 呼叫并通知下一位客户
 • 完成 - 标记当前客户服务结束
 • 回复 [ID] [内容] - 回复咨询的用户
+• 咨询记录 - 查看最近人工咨询及转发状态
 """
     
     help_text += """
@@ -434,10 +725,201 @@ def home():
 @app.route("/health")
 def health():
     """Health check endpoint."""
-    return {"status": "healthy", "rates_count": len(latest_rates)}
+    snapshot = get_snapshot()
+    return {
+        "status": "healthy",
+        "rates_count": len(snapshot.rates),
+        "snapshot_version": snapshot.version,
+        "snapshot_stale": snapshot.stale,
+        "response_cache": response_cache.stats(),
+        "webhook_pool": event_pool.stats(),
+        "profile_cache": profile_cache.stats(),
+        "rate_stream": rate_stream.stats(),
+        "quote_history": quote_history.stats(),
+        "outbox": messenger.stats()
+    }
+
+# Point-in-time values, read when /metrics is scraped
+Gauge('exchange_bot_rate_snapshot_age_seconds', "Age of the rates being served", lambda: get_snapshot().age())
+Gauge('exchange_bot_webhook_queue_depth', "Webhook requests waiting for a worker", lambda: event_pool.stats()['queue_depth'])
+
+def admin_api_authorized():
+    """True if the request carries ADMIN_API_TOKEN as a bearer token."""
+    supplied = request.headers.get('Authorization', '')
+    return hmac.compare_digest(supplied.encode(), f"Bearer {config.ADMIN_API_TOKEN}".encode())
+
+@app.route("/admin/profile", methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    """
+    Runtime profiling of message handling and background jobs.
+    POST starts a session (?calls=N and/or ?seconds=S), DELETE stops it and
+    dumps the stats, GET shows the status.
+    """
+    if not config.ADMIN_API_TOKEN:
+        abort(404)
+    if not admin_api_authorized():
+        abort(403)
+    
+    if request.method == 'POST':
+        try:
+            calls, seconds = (int(request.args[key]) if key in request.args else None for key in ('calls', 'seconds'))
+        except ValueError:
+            return {"error": "calls and seconds must be integers"}, 400
+        return profiler.start(calls, seconds)
+    if request.method == 'DELETE':
+        return {"dumped": profiler.stop()}
+    return profiler.status()
+
+# SIGUSR2 toggles a profiling session with the default limits (each worker separately)
+profiler.install_signal_handler()
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus metrics for this worker process."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def _quote_amounts():
+    """
+    Read batch quote amounts from the request.
+    Either explicit amounts (JSON 'amounts' or ?amount=1000,2000) or a
+    start/stop/step price sheet range (defaults 1,000 to 100,000 step 1,000).
+    Anonymous requests get at most QUOTE_PUBLIC_MAX_AMOUNTS amounts.
+    """
+    max_size = MAX_BATCH_SIZE if config.ADMIN_API_TOKEN and admin_api_authorized() else config.QUOTE_PUBLIC_MAX_AMOUNTS
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or {}
+        if not isinstance(params, dict):
+            raise QuoteError("Request body must be a JSON object")
+        if 'amounts' in params:
+            return parse_amounts(params['amounts'], max_size)
+    else:
+        params = request.args
+        if 'amount' in params:
+            values = [v for item in params.getlist('amount') for v in item.split(',') if v]
+            return parse_amounts(values, max_size)
+    
+    try:
+        start = float(params.get('start', 1000))
+        stop = float(params.get('stop', 100000))
+        step = float(params.get('step', 1000))
+    except (TypeError, ValueError):
+        raise QuoteError("start, stop and step must be numbers")
+    return price_sheet_amounts(start, stop, step, max_size)
+
+def cached_json(snapshot, key, build):
+    """
+    JSON response serialised once per snapshot version (in response_cache),
+    with a strong ETag (If-None-Match -> 304) and max-age up to the next refresh.
+    """
+    body, etag = response_cache.get_or_render(
+        snapshot.version, snapshot.custom_version, key,
+        lambda: rates_api.serialise(build())
+    )
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = rates_api.max_age(snapshot, config.RATE_UPDATE_INTERVAL * 60, config.RATE_SOFT_TTL)
+    return response.make_conditional(request)
+
+@app.route("/api/rates")
+def api_rates():
+    """Current rates, market best and custom rate tiers."""
+    snapshot = current_snapshot()
+    if snapshot.is_empty():
+        return {"error": "Rates not available yet"}, 503
+    
+    return cached_json(snapshot, 'api_rates', lambda: rates_api.snapshot_to_dict(snapshot))
+
+@app.route("/api/rates/history")
+def api_rates_history():
+    """Rate history per provider (?hours=24, optional ?provider=)."""
+    snapshot = current_snapshot()
+    provider = request.args.get('provider') or None
+    try:
+        hours = int(request.args.get('hours', rates_api.DEFAULT_HISTORY_HOURS))
+    except ValueError:
+        return {"error": "hours must be an integer"}, 400
+    if not 0 < hours <= rates_api.MAX_HISTORY_HOURS:
+        return {"error": f"hours must be between 1 and {rates_api.MAX_HISTORY_HOURS}"}, 400
+    if provider is not None and provider not in snapshot.by_provider:
+        return {"error": "Unknown provider"}, 404
+    
+    def build():
+        since = datetime.now() - timedelta(hours=hours)
+        if not quote_history.covers(since.timestamp(), [provider] if provider else None):
+            return rates_api.history_to_dict(get_rate_history(since, provider), hours)
+        quote_history.sync(snapshot, get_rate_history)
+        providers = [provider] if provider else quote_history.providers()
+        windows = {p: quote_history.window(p, since.timestamp()) for p in providers}
+        return rates_api.windows_to_dict({p: w for p, w in windows.items() if w is not None}, hours)
+    
+    return cached_json(snapshot, ('api_history', provider, hours), build)
+
+# Push rate changes to dashboards instead of having them poll
+rate_stream = RateStream(
+    get_snapshot,
+    poll_seconds=config.SNAPSHOT_POLL_SECONDS,
+    heartbeat_seconds=config.SSE_HEARTBEAT_SECONDS,
+    buffer_size=config.SSE_BUFFER_SIZE,
+    max_clients=config.SSE_MAX_CLIENTS
+)
+
+@app.route("/api/rates/stream")
+def api_rates_stream():
+    """
+    Server-Sent Events: a 'snapshot' event with the full rates, then a 'delta'
+    event whenever the published rates change. Reconnects resume from Last-Event-ID.
+    """
+    subscriber = rate_stream.subscribe(request.headers.get('Last-Event-ID'))
+    if subscriber is None:
+        return {"error": "Too many stream clients, try again later"}, 503
+    
+    return Response(
+        rate_stream.stream(subscriber),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route("/api/quote", methods=['GET', 'POST'])
+def api_quote():
+    """Batch quotes (amounts x providers) as JSON."""
+    snapshot = current_snapshot()
+    if snapshot.is_empty():
+        return {"error": "Rates not available yet"}, 503
+    
+    try:
+        amounts = _quote_amounts()
+    except QuoteError as e:
+        return {"error": str(e)}, 400
+    
+    result = quotes_to_dict(build_quotes(amounts, snapshot.display_rates, snapshot.best_buy, snapshot.tier_table))
+    result['snapshot_version'] = snapshot.version
+    return result
+
+@app.route("/api/quote.csv", methods=['GET', 'POST'])
+def api_quote_csv():
+    """Batch quotes as a downloadable CSV price sheet."""
+    snapshot = current_snapshot()
+    if snapshot.is_empty():
+        return {"error": "Rates not available yet"}, 503
+    
+    try:
+        amounts = _quote_amounts()
+    except QuoteError as e:
+        return {"error": str(e)}, 400
+    
+    csv_text = quotes_to_csv(build_quotes(amounts, snapshot.display_rates, snapshot.best_buy, snapshot.tier_table))
+    return Response(
+        csv_text,
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=price_sheet_v{snapshot.version}.csv'}
+    )
 
 if __name__ == "__main__":
     try:
         app.run(host=config.HOST, port=config.PORT, debug=config.DEBUG)
     except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
\ No newline at end of file
+        scheduler_election.stop()
+        messenger.stop()
+        if scheduler.running:
+            scheduler.shutdown()
\ No newline at end of file
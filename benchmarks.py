@@ -0,0 +1,539 @@
+# Micro-benchmarks for the bot's hot paths.
+# Runs against a throwaway SQLite database and synthetic rates, never the network.
+# Scaled benchmarks run once per fixture size, e.g. get_position/queue=1000.
+#
+#   python benchmarks.py                    # run everything
+#   python benchmarks.py route              # run benchmarks whose name contains "route"
+#   python benchmarks.py --save-baseline    # record this machine's results
+#   python benchmarks.py --check            # exit 1 if anything regressed past its threshold
+#   python benchmarks.py --baseline-ref main  # measure main first, then --check this tree against it
+#
+# Baselines depend on the machine, so none is committed: --baseline-ref
+# generates one from a git ref on the same machine right before the check.
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Register a benchmark. The function returns (callable, iterations)."""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+def scaled_benchmark(name, param, sizes):
+    """Register one benchmark per fixture size; the function takes the size."""
+    def decorator(func):
+        for size in sizes:
+            BENCHMARKS[f'{name}/{param}={size}'] = functools.partial(func, size)
+        return func
+    return decorator
+
+# Fixture sizes: today's production scale and well beyond it
+PROVIDER_SIZES = (5, 50, 500)
+QUEUE_SIZES = (10, 1000)
+ALERT_SIZES = (10, 1000)
+HISTORY_SIZES = (1000, 100000)
+
+def synthetic_rates(n_providers=5):
+    """Build a realistic rate list; extra providers beyond the public five are non-public."""
+    public = ['泰国央行参考价', 'Google财经', '国际中间价', 'Yahoo财经', '中国银行(泰国)']
+    rates = []
+    for i in range(n_providers):
+        provider = public[i] if i < len(public) else f'Provider {i}'
+        buying = 4.45 + (i % 17) * 0.01
+        rates.append({
+            'provider': provider,
+            'buying_tt': buying,
+            'selling_tt': buying + 0.05,
+            'status': 'success',
+            'timestamp': '2024-01-01T00:00:00'
+        })
+    return rates
+
+_app = None
+
+def load_app():
+    """
+    Import app inside a scratch directory with synthetic rates, without the
+    background scheduler, and publish the first snapshot.
+    """
+    global _app
+    if _app is None:
+        os.chdir(tempfile.mkdtemp(prefix='exchange_bot_bench_'))
+        os.environ['SCHEDULER_MODE'] = 'off'
+        # Keep per-call INFO logs out of the timings
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'bench')
+        os.environ.setdefault('LINE_CHANNEL_SECRET', 'bench')
+        import scraper
+        scraper.fetch_all_rates = lambda include_all=False: synthetic_rates()
+        import app
+        app.update_rates()
+        import custom_rate
+        custom_rate.set_custom_rate(4.55)
+        _app = app
+    return _app
+
+def reset_table(table, rows, columns):
+    """Replace the contents of a table in the benchmark database with synthetic rows."""
+    from database import get_db
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            rows
+        )
+        conn.commit()
+
+def seed_queue(n):
+    """n waiting customers, queued one second apart."""
+    reset_table('queue', [(f'U_queue_{i}', f'Customer {i}', f'2024-01-01 {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}')
+                          for i in range(n)], ('user_id', 'user_name', 'created_at'))
+
+def seed_alerts(n):
+    """n active alerts, none of which the synthetic rates trigger (so every run does the same work)."""
+    reset_table('alerts', [(f'U_alert_{i}', f'User {i}', 9.0 + i / n, 'above') for i in range(n)],
+                ('user_id', 'user_name', 'target_rate', 'condition'))
+
+def seed_history(n):
+    """n rate history rows spread over the five public providers."""
+    providers = [r['provider'] for r in synthetic_rates()]
+    reset_table('rate_history', [(providers[i % 5], 4.5, 4.55, f'2024-01-01T00:00:{i % 60:02d}.{i:06d}')
+                                 for i in range(n)], ('provider', 'buying_tt', 'selling_tt', 'timestamp'))
+
+def seed_recent_history(n):
+    """n rate history rows over the last 7 days, spread over the five public providers."""
+    from datetime import datetime, timedelta
+    providers = [r['provider'] for r in synthetic_rates()]
+    start = datetime.now() - timedelta(days=7)
+    step = timedelta(days=7) / n
+    reset_table('rate_history', [(providers[i % 5], 4.5 + (i % 100) / 1000, 4.55, start + step * i) for i in range(n)],
+                ('provider', 'buying_tt', 'selling_tt', 'timestamp'))
+
+def measure(func, iterations):
+    """Run func iterations times and return seconds per call (best of 3)."""
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        best = min(best, (time.perf_counter() - start) / iterations)
+    return best
+
+@benchmark('route_rates_uncached')
+def bench_route_rates_uncached():
+    """The pre-cache path: re-filter, re-sort and re-render on every '汇率'."""
+    app = load_app()
+    from calculator import format_all_rates_table
+    from custom_rate import get_custom_rate
+    rates = [dict(r) for r in app.get_snapshot().rates]
+    return (lambda: format_all_rates_table(rates, get_custom_rate())), 2000
+
+@benchmark('route_rates_cached')
+def bench_route_rates_cached():
+    app = load_app()
+    return (lambda: app.route_command('U_bench', 'Bench', '汇率')), 2000
+
+@benchmark('route_calc_uncached')
+def bench_route_calc_uncached():
+    app = load_app()
+    from calculator import get_exchange_summary
+    from custom_rate import get_custom_rate
+    rates = [dict(r) for r in app.get_snapshot().rates]
+    return (lambda: get_exchange_summary(rates, 5000.0, get_custom_rate())), 2000
+
+@benchmark('route_calc_cached')
+def bench_route_calc_cached():
+    app = load_app()
+    return (lambda: app.route_command('U_bench', 'Bench', '计算5000')), 2000
+
+@benchmark('quote_batch_python_10k')
+def bench_quote_batch_python():
+    """Baseline: one calculate_exchange call per amount and provider."""
+    app = load_app()
+    from calculator import calculate_exchange
+    snapshot = app.get_snapshot()
+    amounts = [1000.0 + 10 * i for i in range(10000)]
+    best = snapshot.best_buy['buying_tt']
+    def run_loop():
+        return [[(calculate_exchange(a, r['buying_tt']), a * (r['buying_tt'] - best))
+                 for r in snapshot.display_rates] for a in amounts]
+    return run_loop, 3
+
+@benchmark('quote_batch_numpy_10k')
+def bench_quote_batch_numpy():
+    app = load_app()
+    from quotes import build_quotes, price_sheet_amounts
+    snapshot = app.get_snapshot()
+    amounts = price_sheet_amounts(1000, 100990, 10)
+    return (lambda: build_quotes(amounts, snapshot.display_rates, snapshot.best_buy)), 50
+
+@benchmark('quote_csv_price_sheet')
+def bench_quote_csv():
+    """Full 1,000..100,000 step 1,000 sheet rendered to CSV."""
+    app = load_app()
+    from quotes import build_quotes, price_sheet_amounts, quotes_to_csv
+    snapshot = app.get_snapshot()
+    amounts = price_sheet_amounts()
+    return (lambda: quotes_to_csv(build_quotes(amounts, snapshot.display_rates, snapshot.best_buy))), 200
+
+# One message per command plus unknown text, used by the dispatch benchmarks
+SAMPLE_MESSAGES = [
+    '汇率', 'rate', '计算5000', 'calc 12.5', '排队', '位置', '离开', '预警 4.55',
+    '取消预警', '人工 你好', '回复 Uabc123 hello', '设置汇率 4.55', '设置阶梯 10000:0.02',
+    '清除阶梯', '自动设置', '下一个', '完成', '队列', 'hello there'
+]
+
+def legacy_route_chain(text, admin=True):
+    """The old if/elif chain of route_command, kept only as a benchmark baseline."""
+    text_lower = text.lower()
+    if text_lower in ['汇率', 'rate', 'rates', '查汇率']:
+        return 'rates'
+    if re.match(r'(计算|calc|calculate)\s*(\d+\.?\d*)', text_lower):
+        return 'calc'
+    if text_lower in ['排队', 'queue', 'join']:
+        return 'queue_join'
+    if text_lower in ['位置', 'status', 'position', '我的位置']:
+        return 'queue_status'
+    if text_lower in ['离开', 'leave', '退出排队']:
+        return 'queue_leave'
+    if re.match(r'(预警|alert)\s+(\d+\.?\d*)', text_lower):
+        return 'alert'
+    if text_lower in ['取消预警', 'cancel alert', 'cancel']:
+        return 'alert_cancel'
+    if text_lower.startswith(('人工', '客服', '有人吗')):
+        return 'support'
+    if admin:
+        if re.match(r'回复\s+([a-zA-Z0-9]+)\s+(.+)', text, re.DOTALL):
+            return 'admin_reply'
+        if re.match(r'(设置汇率|setrate)\s+(\d+\.?\d*)', text_lower):
+            return 'set_rate'
+        if re.match(r'(设置阶梯|settiers)\s+(.+)', text_lower):
+            return 'set_tiers'
+        if text_lower in ['清除阶梯', 'cleartiers']:
+            return 'clear_tiers'
+        if text_lower in ['自动设置', 'auto', 'autoset']:
+            return 'auto_set'
+        if text_lower in ['下一个', 'next', '下一位']:
+            return 'next'
+        if text_lower in ['完成', 'done', 'complete']:
+            return 'complete'
+        if text_lower in ['队列', 'queue list', '查看队列']:
+            return 'view_queue'
+    return 'help'
+
+@scaled_benchmark('find_best_rate', 'providers', PROVIDER_SIZES)
+def bench_find_best_rate(n):
+    rates = synthetic_rates(n)
+    from calculator import find_best_rate
+    return (lambda: find_best_rate(rates)), max(20, 100000 // n)
+
+@scaled_benchmark('format_all_rates_table', 'providers', PROVIDER_SIZES)
+def bench_format_all_rates_table(n):
+    load_app()
+    from calculator import format_all_rates_table
+    from custom_rate import get_custom_rate
+    rates = synthetic_rates(n)
+    return (lambda: format_all_rates_table(rates, get_custom_rate())), max(20, 20000 // n)
+
+@scaled_benchmark('get_exchange_summary', 'providers', PROVIDER_SIZES)
+def bench_get_exchange_summary(n):
+    load_app()
+    from calculator import get_exchange_summary
+    from custom_rate import get_custom_rate
+    rates = synthetic_rates(n)
+    return (lambda: get_exchange_summary(rates, 5000.0, get_custom_rate())), max(20, 20000 // n)
+
+# Read-only user messages, so route_command can be repeated without changing state
+ROUTE_MIX = ['汇率', '计算5000', 'calc 12.5', '走势', '位置', '取消预警', 'hello there']
+
+@scaled_benchmark('rate_stats_add', 'window', (336, 8640, 40320))
+def bench_rate_stats_add(n):
+    """One new sample into a full rolling window, expiring the oldest (7 days at 30 min / 30 days at 5 min / 7 days at 15 s)."""
+    from rate_stats import RollingWindow
+    window = RollingWindow(n, 48, n + 1)
+    values = itertools.cycle([4.5 + (i * 7919 % 1000) / 10000 for i in range(1000)])
+    clock = itertools.count()
+    for _ in range(n):
+        window.add(next(clock), next(values))
+    return (lambda: window.add(next(clock), next(values))), 20000
+
+@scaled_benchmark('history_24h_sqlite', 'history', HISTORY_SIZES)
+def bench_history_sqlite(n):
+    """One provider's last 24h as rows from rate_history (the pre-ring-buffer path)."""
+    load_app()
+    seed_recent_history(n)
+    from datetime import datetime, timedelta
+    from database import get_rate_history
+    return (lambda: get_rate_history(datetime.now() - timedelta(hours=24), 'Google财经')), max(5, 200000 // n)
+
+@scaled_benchmark('history_24h_ring', 'history', HISTORY_SIZES)
+def bench_history_ring(n):
+    """The same window as columns from the in-memory quote ring."""
+    load_app()
+    seed_recent_history(n)
+    from database import get_rate_history
+    from quote_history import QuoteHistory
+    history = QuoteHistory(capacity=n, days=7)
+    history.seed(get_rate_history)
+    since = time.time() - 24 * 3600
+    return (lambda: history.window('Google财经', since)), max(50, 2000000 // n)
+
+@scaled_benchmark('route_command_mix', 'queue', QUEUE_SIZES)
+def bench_route_command_mix(n):
+    """A user's command mix end to end (position lookups scan the queue)."""
+    app = load_app()
+    seed_queue(n)
+    messages = itertools.cycle(ROUTE_MIX)
+    return (lambda: app.route_command('U_queue_0', 'Bench', next(messages))), 600
+
+@scaled_benchmark('get_position', 'queue', QUEUE_SIZES)
+def bench_get_position(n):
+    """The last customer in the queue (worst case)."""
+    load_app()
+    seed_queue(n)
+    from queue_manager import get_position
+    return (lambda: get_position(f'U_queue_{n - 1}')), max(20, 50000 // n)
+
+@scaled_benchmark('check_alerts_and_notify', 'alerts', ALERT_SIZES)
+def bench_check_alerts(n):
+    load_app()
+    seed_alerts(n)
+    from alerts import check_alerts_and_notify
+    rates = synthetic_rates()
+    return (lambda: check_alerts_and_notify(rates)), max(20, 20000 // n)
+
+@scaled_benchmark('save_rate_history', 'history', HISTORY_SIZES)
+def bench_save_rate_history(n):
+    """One refresh's worth of rows appended to a history table of n rows."""
+    load_app()
+    seed_history(n)
+    from database import save_rate_history
+    rates = synthetic_rates()
+    return (lambda: save_rate_history(rates)), 200
+
+@benchmark('api_rates_serialise')
+def bench_api_rates_serialise():
+    """/api/rates without the per-version cache: build and encode the body every time."""
+    app = load_app()
+    import rates_api
+    snapshot = app.get_snapshot()
+    return (lambda: rates_api.serialise(rates_api.snapshot_to_dict(snapshot))), 5000
+
+@benchmark('api_rates_200')
+def bench_api_rates_200():
+    """Full Flask request for /api/rates, body served from the cache."""
+    client = load_app().app.test_client()
+    return (lambda: client.get('/api/rates')), 2000
+
+@benchmark('api_rates_304')
+def bench_api_rates_304():
+    """A polling client that already has the current version (If-None-Match)."""
+    client = load_app().app.test_client()
+    etag = client.get('/api/rates').headers['ETag']
+    return (lambda: client.get('/api/rates', headers={'If-None-Match': etag})), 2000
+
+@benchmark('dispatch_legacy_chain')
+def bench_dispatch_legacy():
+    """Per-message routing cost of the old chain (admin checks excluded)."""
+    messages = itertools.cycle(SAMPLE_MESSAGES)
+    return (lambda: legacy_route_chain(next(messages))), 20000
+
+@benchmark('dispatch_compiled')
+def bench_dispatch_compiled():
+    """Per-message routing cost of the compiled dispatcher."""
+    app = load_app()
+    messages = itertools.cycle(SAMPLE_MESSAGES)
+    return (lambda: app.router.match(next(messages))), 20000
+
+# Child process for the startup benchmarks: import app with a slow provider fetch
+# and exit as soon as it can answer a rate query.
+_STARTUP_SCRIPT = """
+import os, sys, time
+import benchmarks, scraper
+def slow_fetch(include_all=False):
+    time.sleep(float(os.environ['BENCH_FETCH_DELAY']))
+    return benchmarks.synthetic_rates()
+scraper.fetch_all_rates = slow_fetch
+import app
+if os.environ['SCHEDULER_MODE'] == 'off':
+    app.update_rates()
+sys.stdout.write(app.handle_rate_display()[:1])
+sys.stdout.flush()
+os._exit(0 if not app.get_snapshot().is_empty() else 1)
+"""
+
+STARTUP_FETCH_DELAY = 1.0
+
+def startup_run(blocking):
+    """Start a fresh interpreter on the benchmark database until the first rate reply."""
+    load_app()
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.abspath(__file__)),
+        BENCH_FETCH_DELAY=str(STARTUP_FETCH_DELAY),
+        SCHEDULER_MODE='off' if blocking else 'auto',
+        SCHEDULER_LOCK_FILE=os.path.join(os.getcwd(), 'bench_scheduler.lock'),
+        LOG_LEVEL='WARNING'
+    )
+    subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], env=env, check=True, stdout=subprocess.DEVNULL)
+
+@benchmark('startup_blocking_fetch')
+def bench_startup_blocking():
+    """The old startup: the first refresh (here a 1s provider fetch) runs before serving."""
+    return (lambda: startup_run(blocking=True)), 1
+
+@benchmark('startup_warm')
+def bench_startup_warm():
+    """Warm start: serve the persisted snapshot while the first refresh runs in the background."""
+    return (lambda: startup_run(blocking=False)), 1
+
+# Allowed slowdown against the baseline before --check fails (0.25 = 25% slower)
+DEFAULT_THRESHOLD = 0.25
+
+# Benchmarks noisier than the rest (subprocesses, commits to disk) get more room
+THRESHOLDS = {
+    'check_alerts_and_notify': 0.5,
+    'save_rate_history': 0.5,
+    'startup_blocking_fetch': 0.5,
+    'startup_warm': 0.5,
+}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')
+
+def threshold_for(name, default):
+    return THRESHOLDS.get(name.split('/')[0], default)
+
+def load_baseline(path):
+    """Seconds per call by benchmark name from a baseline file ({} if missing)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+def save_baseline(path, results):
+    """Merge results into the baseline file (benchmarks not run keep their old value)."""
+    merged = load_baseline(path)
+    merged.update(results)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'saved_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': dict(sorted(merged.items()))
+        }, f, indent=2)
+        f.write('\n')
+
+def baseline_from_ref(ref, name_filter, path):
+    """
+    Run the current benchmark definitions against the code at a git ref (in a
+    temporary worktree) and save the results as the baseline at path.
+    Benchmarks of code the ref does not have yet are skipped, and show as new.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    worktree = tempfile.mkdtemp(prefix='exchange_bot_bench_ref_')
+    subprocess.run(['git', 'worktree', 'add', '--detach', worktree, ref], cwd=root, check=True,
+                   stdout=subprocess.DEVNULL)
+    try:
+        shutil.copy(os.path.join(root, 'benchmarks.py'), worktree)
+        print(f"Measuring baseline at {ref}")
+        subprocess.run([sys.executable, 'benchmarks.py', name_filter, '--save-baseline', '--baseline', path,
+                        '--skip-errors'], cwd=worktree, check=True)
+        print()
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', worktree], cwd=root, check=False)
+
+def run(selected, baseline=None, threshold=DEFAULT_THRESHOLD, skip_errors=False):
+    """
+    Run benchmarks, comparing each with its baseline if given.
+    With skip_errors, a benchmark whose setup fails is reported and left out.
+
+    Returns:
+        (seconds per call by name, names that regressed past their threshold)
+    """
+    header = f"{'benchmark':<44}{'us/call':>12}{'calls/s':>14}"
+    if baseline is not None:
+        header += f"{'baseline':>12}{'change':>10}"
+    print(header)
+    results, regressions = {}, []
+    for name in selected:
+        try:
+            func, iterations = BENCHMARKS[name]()
+        except Exception as e:
+            if not skip_errors:
+                raise
+            print(f"{name:<44}{'skipped':>12}  {type(e).__name__}: {e}")
+            continue
+        seconds = measure(func, iterations)
+        results[name] = seconds
+        line = f"{name:<44}{seconds * 1e6:>12.1f}{1 / seconds:>14,.0f}"
+        if baseline is not None:
+            before = baseline.get(name)
+            if before is None:
+                line += f"{'-':>12}{'new':>10}"
+            else:
+                change = seconds / before - 1
+                line += f"{before * 1e6:>12.1f}{change:>+10.0%}"
+                if change > threshold_for(name, threshold):
+                    regressions.append(name)
+                    line += '  REGRESSION'
+        print(line)
+    return results, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run bot micro-benchmarks")
+    parser.add_argument('filter', nargs='?', default='', help="Only run benchmarks whose name contains this")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline file (results are machine specific)")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the baseline")
+    parser.add_argument('--check', action='store_true', help="Fail if a benchmark is slower than its baseline by more than the threshold")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown for --check, as a fraction (default 0.25)")
+    parser.add_argument('--baseline-ref', metavar='REF',
+                        help="Generate the baseline for --check by measuring this git ref first (e.g. main)")
+    parser.add_argument('--skip-errors', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    selected = [name for name in BENCHMARKS if args.filter in name]
+    if not selected:
+        print(f"No benchmark matches '{args.filter}'")
+        return 1
+
+    # load_app() changes directory, so resolve the baseline path first
+    baseline_path = os.path.abspath(args.baseline)
+    if args.baseline_ref:
+        # A fresh baseline for this run only; the stored one is left alone
+        baseline_path = os.path.join(tempfile.mkdtemp(prefix='exchange_bot_bench_'), 'baseline.json')
+        baseline_from_ref(args.baseline_ref, args.filter, baseline_path)
+        args.check = True
+    baseline = load_baseline(baseline_path) if args.check else None
+    if args.check and not baseline and not args.baseline_ref:
+        print(f"No baseline at {baseline_path}; run with --save-baseline first, or use --baseline-ref")
+        return 1
+
+    results, regressions = run(selected, baseline, args.threshold, args.skip_errors)
+    if args.save_baseline:
+        save_baseline(baseline_path, results)
+        print(f"\nBaseline saved to {baseline_path}")
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
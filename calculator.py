@@ -1,3 +1,23 @@
+# Providers shown to customers
+PUBLIC_SOURCES = ('泰国央行参考价', 'Google财经', '国际中间价', 'Yahoo财经', '中国银行(泰国)')
+
+# Percentile rank in the recent window at or above which the market counts as high / at or below as low
+HIGH_PERCENTILE = 80
+LOW_PERCENTILE = 20
+
+def filter_public_rates(rates):
+    """Keep only successful rates from the approved public sources."""
+    return [r for r in rates if r.get('provider') in PUBLIC_SOURCES and r.get('status') in ['success', 'fallback']]
+
+def sort_for_display(rates):
+    """
+    Filters valid rates and sorts them for display:
+    custom rate first, then by buying rate descending.
+    """
+    valid_rates = [r for r in rates if r.get('status') in ['success', 'fallback', 'custom']]
+    valid_rates.sort(key=lambda x: (x.get('status') == 'custom', x.get('buying_tt', 0)), reverse=True)
+    return valid_rates
+
 def find_best_rate(rates, rate_type='buying_tt'):
     """
     Finds the best TT rate from a list of rate providers.
@@ -38,13 +58,14 @@ def format_rate_comparison(rates, highlight_provider='优选汇率'):
     if not rates:
         return "❌ 无法获取汇率数据 (Unable to fetch rate data)"
     
-    # Sort by buying rate descending
-    valid_rates = [r for r in rates if r.get('status') in ['success', 'fallback', 'custom']]
-    # Custom rate should always be at the top if it exists
-    valid_rates.sort(key=lambda x: (x.get('status') == 'custom', x.get('buying_tt', 0)), reverse=True)
-    
-    output = "💱 **CNY → THB 电汇汇率**\n"
-    output += "=" * 30 + "\n\n"
+    # Sort by buying rate descending, custom rate always at the top
+    return render_rate_comparison(sort_for_display(rates))
+
+def render_rate_comparison(valid_rates):
+    """
+    Formats rates that are already filtered and sorted by sort_for_display.
+    """
+    lines = ["💱 **CNY → THB 电汇汇率**\n", "=" * 30 + "\n\n"]
     
     for idx, rate in enumerate(valid_rates, 1):
         provider = rate['provider']
@@ -60,27 +81,46 @@ def format_rate_comparison(rates, highlight_provider='优选汇率'):
         
         status_icon = "✅" if rate['status'] in ['success', 'custom'] else "📊"
         
-        output += f"{prefix}{status_icon} **{provider}**\n"
-        output += f"   买入: {buying:.4f} | 卖出: {selling:.4f}\n\n"
+        lines.append(f"{prefix}{status_icon} **{provider}**\n")
+        lines.append(f"   买入: {buying:.4f} | 卖出: {selling:.4f}\n\n")
     
-    return output
+    return "".join(lines)
 
 def get_exchange_summary(rates, amount_cny=1000, custom_rate=None, highlight_provider='优选汇率'):
     """
     Generates a comprehensive summary with calculation.
     """
     # Filter public display: Focus on reliable references
-    public_sources = ['泰国央行参考价', 'Google财经', '国际中间价', 'Yahoo财经', '中国银行(泰国)']
-    public_rates = [r for r in rates if r.get('provider') in public_sources and r.get('status') in ['success', 'fallback']]
-    
-    # Add custom rate if provided
-    active_rates = list(public_rates)
-    if custom_rate and custom_rate.get('status') == 'custom':
-        active_rates.insert(0, custom_rate)
+    public_rates = filter_public_rates(rates)
+    market_best = find_best_rate(public_rates, 'buying_tt')
+    return render_exchange_summary(public_rates, market_best, amount_cny, custom_rate)
+
+def rate_status(rate, percentile=None):
+    """
+    The 汇率状态 line: from the market best's percentile rank in its recent
+    window when known, else from fixed thresholds on rate.
+    """
+    if percentile is None:
+        high, low = rate >= 4.55, rate < 4.45
+    else:
+        high, low = percentile >= HIGH_PERCENTILE, percentile <= LOW_PERCENTILE
+    if high:
+        return "🟢 **汇率状态**: 高位,适合兑换!\n"
+    if low:
+        return "🔴 **汇率状态**: 偏低,建议等待\n"
+    return "🟡 **汇率状态**: 正常水平\n"
+
+def render_exchange_summary(public_rates, market_best, amount_cny, custom_rate=None, tier=None, percentile=None):
+    """
+    Generates the calculation summary from precomputed public rates and market best.
     
-    best_deal = find_best_rate(active_rates, 'buying_tt')
+    Args:
+        tier: (min_amount, buy_adj, sell_adj) band already applied to custom_rate (optional)
+        percentile: Market best's percentile rank in its recent window (optional, see rate_stats)
+    """
+    has_custom = bool(custom_rate and custom_rate.get('status') == 'custom')
     
-    if not active_rates:
+    if not public_rates and not has_custom:
         return "❌ 当前无法获取有效汇率数据\n(No valid rate data available)"
     
     summary = "💰 **人民币兑换泰铢 CNY → THB**\n"
@@ -89,15 +129,17 @@ def get_exchange_summary(rates, amount_cny=1000, custom_rate=None, highlight_pro
     # Show calculation
     summary += f"💵 计算金额: **{amount_cny:,.0f} CNY**\n\n"
     
-    # Preferred rate (Custom) if exists
-    target_rate = custom_rate if custom_rate else best_deal
+    # Preferred rate (Custom) if exists, otherwise the best market rate
+    target_rate = custom_rate if custom_rate else market_best
     if target_rate:
         target_thb = calculate_exchange(amount_cny, target_rate['buying_tt'])
         summary += f"⭐ **{target_rate['provider']}**: {target_rate['buying_tt']:.4f}\n"
-        summary += f"   可得: **{target_thb:,.2f} THB**\n\n"
+        summary += f"   可得: **{target_thb:,.2f} THB**\n"
+        if tier and tier[1]:
+            summary += f"   🎯 大额优惠: ≥{tier[0]:,.0f} CNY 买入 {tier[1]:+.2f}\n"
+        summary += "\n"
     
     # Market Best comparison if different
-    market_best = find_best_rate(public_rates, 'buying_tt')
     if market_best and market_best != target_rate:
         market_thb = calculate_exchange(amount_cny, market_best['buying_tt'])
         summary += f"🏆 **市场最高**: {market_best['provider']}\n"
@@ -110,13 +152,7 @@ def get_exchange_summary(rates, amount_cny=1000, custom_rate=None, highlight_pro
         summary += "\n"
     
     # Rate status indicator
-    ref_rate = target_rate['buying_tt']
-    if ref_rate >= 4.55:
-        summary += "🟢 **汇率状态**: 高位,适合兑换!\n"
-    elif ref_rate >= 4.45:
-        summary += "🟡 **汇率状态**: 正常水平\n"
-    else:
-        summary += "🔴 **汇率状态**: 偏低,建议等待\n"
+    summary += rate_status(target_rate['buying_tt'], percentile)
     
     summary += "\n" + "=" * 35 + "\n"
     summary += "💡 输入 '汇率' 查看详细对比\n"
@@ -130,18 +166,25 @@ def format_all_rates_table(rates, custom_rate=None):
     Format all rates in a detailed table for LINE display.
     """
     # Filter to only approved public rates
-    public_sources = ['泰国央行参考价', 'Google财经', '国际中间价', 'Yahoo财经', '中国银行(泰国)']
-    public_rates = [r for r in rates if r.get('provider') in public_sources and r.get('status') in ['success', 'fallback']]
+    public_rates = filter_public_rates(rates)
     
     # Prepare full list for comparison
     comparison_list = list(public_rates)
     if custom_rate and custom_rate.get('status') == 'custom':
         comparison_list.insert(0, custom_rate)
     
-    highlight_name = custom_rate.get('provider') if custom_rate else '优选汇率'
-    comparison = format_rate_comparison(comparison_list, highlight_provider=highlight_name)
-    
     best_market = find_best_rate(public_rates, 'buying_tt')
+    return render_rates_table(sort_for_display(comparison_list), best_market, custom_rate)
+
+def render_rates_table(display_rates, best_market, custom_rate=None):
+    """
+    Format the rates table from rates already sorted by sort_for_display.
+    """
+    if not display_rates:
+        comparison = "❌ 无法获取汇率数据 (Unable to fetch rate data)"
+    else:
+        comparison = render_rate_comparison(display_rates)
+    
     rec_provider = custom_rate.get('provider') if custom_rate else (best_market['provider'] if best_market else "优选汇率")
     
     footer = f"\n💡 **建议**\n推荐使用 [**{rec_provider}**] 兑换\n"
@@ -157,3 +200,40 @@ def format_all_rates_table(rates, custom_rate=None):
     footer += "• 输入 '人工' 直接联系管理员咨询"
     
     return comparison + footer
+
+def trend_arrow(stats):
+    """↗/↘ when the latest rate is more than one typical move away from its EWMA, else →."""
+    band = stats['ewma'] * (stats['volatility'] or 0.0)
+    if stats['last'] > stats['ewma'] + band:
+        return "↗"
+    if stats['last'] < stats['ewma'] - band:
+        return "↘"
+    return "→"
+
+def render_trend(provider_stats, market_best, percentile=None, days=7):
+    """
+    Format the 走势 reply from rolling statistics.
+    
+    Args:
+        provider_stats: [(provider, stats dict from rate_stats)] in display order
+        market_best: Current market best rate dict (optional)
+        percentile: Market best's percentile rank, for the status line (optional)
+        days: Length of the statistics window, for the title
+    """
+    provider_stats = [(p, s) for p, s in provider_stats if s and s['samples'] >= 2]
+    if not provider_stats:
+        return "⏳ 走势数据不足,请稍后再试"
+    
+    lines = [f"📈 **汇率走势** (近{days:g}天)", "=" * 35, ""]
+    for provider, stats in provider_stats:
+        lines.append(f"{trend_arrow(stats)} **{provider}**: {stats['last']:.4f}")
+        lines.append(f"   均值: {stats['ewma']:.4f} | 区间: {stats['min']:.4f} - {stats['max']:.4f}")
+        volatility = f"{stats['volatility'] * 100:.2f}%" if stats['volatility'] is not None else "-"
+        lines.append(f"   波动: {volatility} | 分位: {stats['percentile']:.0f}%")
+        lines.append("")
+    
+    if market_best:
+        lines.append(rate_status(market_best['buying_tt'], percentile).rstrip())
+    lines.append("=" * 35)
+    lines.append("💡 ↗/↘ = 明显高于/低于近期均值, 分位 = 当前价在区间中的位置")
+    return "\n".join(lines)
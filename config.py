@@ -18,12 +18,69 @@ if not LINE_CHANNEL_SECRET:
 # To get your LINE user ID, send a message to the bot and check the logs
 ADMIN_USER_IDS = os.getenv('ADMIN_USER_IDS', '').split(',')
 
+# Seconds between checks of the admins table for changes made by other processes
+ADMIN_REFRESH_SECONDS = int(os.getenv('ADMIN_REFRESH_SECONDS', '30'))
+
 # Rate update schedule (minutes)
 RATE_UPDATE_INTERVAL = int(os.getenv('RATE_UPDATE_INTERVAL', '30'))
 
+# Where background jobs (rate updates, alerts) run:
+#   auto       - the web worker holding SCHEDULER_LOCK_FILE runs them (one per host)
+#   standalone - only `python run_scheduler.py` runs them
+#   off        - never (e.g. tests)
+SCHEDULER_MODE = os.getenv('SCHEDULER_MODE', 'auto').lower()
+SCHEDULER_LOCK_FILE = os.getenv('SCHEDULER_LOCK_FILE', 'scheduler.lock')
+SCHEDULER_RETRY_SECONDS = int(os.getenv('SCHEDULER_RETRY_SECONDS', '15'))
+
+# Seconds between checks for a rate snapshot published by another worker process
+SNAPSHOT_POLL_SECONDS = float(os.getenv('SNAPSHOT_POLL_SECONDS', '2'))
+
+# Soft TTL (seconds): a user request that finds older rates is served immediately
+# and triggers one background refresh for the whole host. 0 disables on-demand refresh.
+RATE_SOFT_TTL = int(os.getenv('RATE_SOFT_TTL', '300'))
+REFRESH_LOCK_FILE = os.getenv('REFRESH_LOCK_FILE', 'refresh.lock')
+
+# Send every rate provider request to this base URL instead (scheme://host[:port]); empty uses the real sites
+RATE_PROVIDER_BASE_URL = os.getenv('RATE_PROVIDER_BASE_URL', '').rstrip('/')
+
+# Days of quotes kept in memory per provider (charts, trends, alert backtests; seeds the statistics below)
+QUOTE_HISTORY_DAYS = float(os.getenv('QUOTE_HISTORY_DAYS', '7'))
+
+# Rolling rate statistics (status labels, 走势): window length (days) and EWMA span (hours)
+RATE_STATS_DAYS = float(os.getenv('RATE_STATS_DAYS', '7'))
+RATE_STATS_EWMA_HOURS = float(os.getenv('RATE_STATS_EWMA_HOURS', '24'))
+
+# Most amounts per /api/quote request without ADMIN_API_TOKEN (the endpoints are public)
+QUOTE_PUBLIC_MAX_AMOUNTS = int(os.getenv('QUOTE_PUBLIC_MAX_AMOUNTS', '2000'))
+
 # Alert check interval (minutes)
 ALERT_CHECK_INTERVAL = int(os.getenv('ALERT_CHECK_INTERVAL', '30'))
 
+# Re-derive the custom rate from the BOC Thailand reference after every rate update
+AUTO_SYNC_CUSTOM_RATE = os.getenv('AUTO_SYNC_CUSTOM_RATE', 'False').lower() == 'true'
+
+# Webhook worker pool: events are queued and handled after /callback returns
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+# Seconds a reply token is trusted; older events are answered with a push message
+REPLY_TOKEN_TTL = int(os.getenv('REPLY_TOKEN_TTL', '50'))
+
+# Outbound LINE messages: API base URL (point it at a stand-in for load tests), keep-alive connections, API calls per second (per process),
+# outbox sender threads (in the scheduler leader) and delivery attempts before giving up
+LINE_API_ENDPOINT = os.getenv('LINE_API_ENDPOINT', 'https://api.line.me').rstrip('/')
+LINE_POOL_SIZE = int(os.getenv('LINE_POOL_SIZE', '16'))
+LINE_API_RATE = float(os.getenv('LINE_API_RATE', '50'))
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '2'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+
+# Seconds after a support request in which the same user's further messages are folded into it, not relayed again
+SUPPORT_DEDUPE_SECONDS = int(os.getenv('SUPPORT_DEDUPE_SECONDS', '300'))
+
+# LINE display name cache (entries, seconds)
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '1000'))
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', '3600'))
+
 # Database path
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'exchange_bot.db')
 
@@ -31,3 +88,23 @@ DATABASE_PATH = os.getenv('DATABASE_PATH', 'exchange_bot.db')
 HOST = os.getenv('HOST', '0.0.0.0')
 PORT = int(os.getenv('PORT', '5000'))
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+
+# Logging: level, 'json' (one object per line) or 'text', and the share of
+# verbose per-message diagnostics that is logged (0.0 - 1.0)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))
+
+# Server-Sent Events (/api/rates/stream): clients per worker process (each holds a
+# server thread), per-client event buffer, and seconds between keep-alive comments
+SSE_MAX_CLIENTS = int(os.getenv('SSE_MAX_CLIENTS', '48'))
+SSE_BUFFER_SIZE = int(os.getenv('SSE_BUFFER_SIZE', '16'))
+SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
+# Bearer token for admin HTTP endpoints (e.g. /admin/profile); empty disables them
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN', '')
+
+# On-demand profiling (POST /admin/profile or SIGUSR2): default limits and output directory
+PROFILE_DEFAULT_CALLS = int(os.getenv('PROFILE_DEFAULT_CALLS', '200'))
+PROFILE_DEFAULT_SECONDS = int(os.getenv('PROFILE_DEFAULT_SECONDS', '60'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
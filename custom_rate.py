@@ -1,12 +1,22 @@
 import json
 import logging
+import os
+import sqlite3
 from datetime import datetime
 
-logging.basicConfig(level=logging.INFO)
+from database import get_db
 
-# Storage file for custom rates
+# Legacy storage file, imported once into custom_rate_history if present
 RATE_FILE = 'custom_rate.json'
 
+CUSTOM_RATE_COLUMNS = 'version, provider, buying_tt, selling_tt, last_updated_by, timestamp, tiers'
+
+# Provider whose buying rate the custom rate is derived from
+REFERENCE_PROVIDER = '中国银行(泰国)'
+
+# Callbacks run with the new rate dict whenever a new version is saved
+_change_listeners = []
+
 def round_to_05(value):
     """
     Rounds a value to the nearest 0.05.
@@ -14,15 +24,66 @@ def round_to_05(value):
     """
     return round(value * 20) / 20
 
-def set_custom_rate(buying_tt, selling_tt=None, provider_name="优选汇率"):
+def _row_to_rate(row):
+    """Convert a custom_rate_history row to the rate dict used everywhere else."""
+    return {
+        'provider': row['provider'],
+        'buying_tt': row['buying_tt'],
+        'selling_tt': row['selling_tt'],
+        'status': 'custom',
+        'timestamp': row['timestamp'],
+        'last_updated_by': row['last_updated_by'],
+        'tiers': json.loads(row['tiers']) if row['tiers'] else [],
+        'version': row['version']
+    }
+
+def _insert_rate(rate_data):
+    """Append a new version to custom_rate_history and return its version number."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO custom_rate_history
+                (provider, buying_tt, selling_tt, last_updated_by, timestamp, tiers)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            rate_data['provider'],
+            rate_data['buying_tt'],
+            rate_data['selling_tt'],
+            rate_data.get('last_updated_by'),
+            rate_data['timestamp'],
+            json.dumps(rate_data.get('tiers') or [])
+        ))
+        conn.commit()
+        return cursor.lastrowid
+
+def on_custom_rate_change(callback):
+    """
+    Register a callback(rate_data) to run whenever a new custom rate version is saved.
+    Can be used as a decorator.
+    """
+    _change_listeners.append(callback)
+    return callback
+
+def _notify_change(rate_data):
+    """Run all change listeners; a failing listener never blocks the others."""
+    for callback in _change_listeners:
+        try:
+            callback(rate_data)
+        except Exception as e:
+            logging.error(f"Custom rate listener {callback.__name__} failed: {e}")
+
+def set_custom_rate(buying_tt, selling_tt=None, provider_name="优选汇率", updated_by='admin', tiers=None):
     """
     Set custom exchange rate.
     Automatically rounds to nearest 0.05.
+    Every call appends a new version to custom_rate_history; nothing is overwritten.
     
     Args:
         buying_tt: Buying TT rate (what you pay customers for their CNY)
         selling_tt: Selling TT rate (optional, defaults to buying + 0.20)
         provider_name: Display name for your rates
+        updated_by: Who set the rate (recorded in the history)
+        tiers: Amount-band adjustments (optional, defaults to the current tiers)
     """
     # Round to nearest 0.05
     buying_rounded = round_to_05(buying_tt)
@@ -33,60 +94,198 @@ def set_custom_rate(buying_tt, selling_tt=None, provider_name="优选汇率"):
     else:
         selling_rounded = round_to_05(selling_tt)
     
+    if tiers is None:
+        current = get_custom_rate()
+        tiers = current['tiers'] if current else []
+    
     rate_data = {
         'provider': provider_name,
         'buying_tt': buying_rounded,
         'selling_tt': selling_rounded,
         'status': 'custom',
         'timestamp': datetime.now().isoformat(),
-        'last_updated_by': 'admin'
+        'last_updated_by': updated_by,
+        'tiers': tiers
     }
     
-    # Save to file
+    # Append to history
     try:
-        with open(RATE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(rate_data, f, ensure_ascii=False, indent=2)
-        logging.info(f"Custom rate set: Buy={buying_rounded}, Sell={selling_rounded}")
-    except Exception as e:
+        rate_data['version'] = _insert_rate(rate_data)
+        logging.info(f"Custom rate set: Buy={buying_rounded}, Sell={selling_rounded} (v{rate_data['version']})")
+    except sqlite3.Error as e:
         logging.error(f"Failed to save custom rate: {e}")
+        return rate_data
     
+    _notify_change(rate_data)
     return rate_data
 
-def get_custom_rate():
+def set_rate_tiers(tiers, updated_by='admin'):
     """
-    Get the current custom exchange rate.
-    Returns None if not set.
+    Save a new version with the current buy/sell pair and new amount-band tiers.
+    Returns None if no custom rate has been set yet.
+    """
+    current = get_custom_rate()
+    if not current:
+        return None
+    return set_custom_rate(
+        current['buying_tt'], current['selling_tt'],
+        provider_name=current['provider'], updated_by=updated_by, tiers=tiers
+    )
+
+def _import_legacy_file():
+    """
+    Import the old single-file custom rate as the first history version.
+    Only used when the history table is still empty.
     """
+    if not os.path.exists(RATE_FILE):
+        return None
     try:
         with open(RATE_FILE, 'r', encoding='utf-8') as f:
             rate_data = json.load(f)
+        rate_data.setdefault('tiers', [])
+        rate_data['version'] = _insert_rate(rate_data)
+        logging.info(f"Imported legacy custom rate from {RATE_FILE} as v{rate_data['version']}")
         return rate_data
-    except FileNotFoundError:
-        logging.warning("No custom rate set yet")
-        return None
     except Exception as e:
+        logging.error(f"Failed to import legacy custom rate: {e}")
+        return None
+
+def get_custom_rate():
+    """
+    Get the current custom exchange rate (the latest version).
+    Returns None if not set.
+    """
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            # version is the INTEGER PRIMARY KEY, so this is an index lookup
+            cursor.execute(f'''
+                SELECT {CUSTOM_RATE_COLUMNS} FROM custom_rate_history
+                ORDER BY version DESC
+                LIMIT 1
+            ''')
+            row = cursor.fetchone()
+    except sqlite3.Error as e:
         logging.error(f"Failed to load custom rate: {e}")
         return None
+    
+    if row:
+        return _row_to_rate(row)
+    
+    rate_data = _import_legacy_file()
+    if not rate_data:
+        logging.warning("No custom rate set yet")
+    return rate_data
 
-def auto_set_from_ref(ref_rate_dict, provider_name="优选汇率"):
+def get_custom_rate_version():
     """
-    Automatically set custom rate based on a reference rate dictionary.
-    Logic: Reference buying rate rounded to 0/5. Sell = Buy + 0.20.
+    Get the current custom rate version number (0 if never set).
+    Cheap enough to be used as a cache invalidation key.
+    """
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(version) FROM custom_rate_history')
+            return cursor.fetchone()[0] or 0
+    except sqlite3.Error as e:
+        logging.error(f"Failed to read custom rate version: {e}")
+        return 0
+
+def get_custom_rate_at(when):
+    """
+    Get the custom rate that was in effect at a given time.
+    
+    Args:
+        when: datetime or ISO timestamp string
+    
+    Returns:
+        Rate dictionary, or None if no rate had been set by then
     """
-    if ref_rate_dict.get('status') not in ['success', 'fallback']:
+    if isinstance(when, datetime):
+        when = when.isoformat()
+    
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {CUSTOM_RATE_COLUMNS} FROM custom_rate_history
+            WHERE timestamp <= ?
+            ORDER BY timestamp DESC, version DESC
+            LIMIT 1
+        ''', (when,))
+        row = cursor.fetchone()
+        return _row_to_rate(row) if row else None
+
+def get_custom_rate_history(limit=20):
+    """Get the most recent custom rate versions, newest first."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {CUSTOM_RATE_COLUMNS} FROM custom_rate_history
+            ORDER BY version DESC
+            LIMIT ?
+        ''', (limit,))
+        return [_row_to_rate(row) for row in cursor.fetchall()]
+
+def _target_from_ref(ref_rate_dict):
+    """
+    Derive the rounded buying rate from a reference rate dictionary.
+    Returns None if the reference is unusable.
+    """
+    if not ref_rate_dict or ref_rate_dict.get('status') not in ['success', 'fallback']:
         logging.error("Invalid reference rate provided")
         return None
     
-    base_rate = ref_rate_dict.get('buying_tt', 0.0)
+    base_rate = ref_rate_dict.get('buying_tt') or 0.0
     if base_rate == 0.0:
         return None
-        
+    
     # logic: round to 0.05
-    target_buy = round_to_05(base_rate)
+    return round_to_05(base_rate)
+
+def auto_set_from_ref(ref_rate_dict, provider_name="优选汇率"):
+    """
+    Automatically set custom rate based on a reference rate dictionary.
+    Logic: Reference buying rate rounded to 0/5. Sell = Buy + 0.20.
+    """
+    target_buy = _target_from_ref(ref_rate_dict)
+    if target_buy is None:
+        return None
     
     return set_custom_rate(target_buy, provider_name=provider_name)
 
+def sync_from_rates(rates_by_provider, provider_name="优选汇率"):
+    """
+    Pipeline stage run after each rate refresh.
+    Re-derives the rounded custom rate from the reference provider and saves
+    a new version only when the rounded buy/sell pair actually changes.
+    
+    Args:
+        rates_by_provider: Dict of provider name -> rate dictionary
+        provider_name: Display name for your rates
+    
+    Returns:
+        The new rate dictionary if a new version was saved, otherwise None
+    """
+    target_buy = _target_from_ref(rates_by_provider.get(REFERENCE_PROVIDER))
+    if target_buy is None:
+        return None
+    
+    target_sell = target_buy + 0.20
+    current = get_custom_rate()
+    if (current and current['provider'] == provider_name
+            and abs(current['buying_tt'] - target_buy) < 1e-9
+            and abs(current['selling_tt'] - target_sell) < 1e-9):
+        return None
+    
+    return set_custom_rate(target_buy, provider_name=provider_name, updated_by='auto_sync')
+
 if __name__ == "__main__":
+    from log_config import configure_logging
+    configure_logging()
+    
+    from database import init_database
+    init_database()
+    
     # Example usage
     print("Setting custom rate to 4.55...")
     rate = set_custom_rate(4.55)
@@ -95,6 +294,7 @@ if __name__ == "__main__":
     print("\nGetting custom rate...")
     current = get_custom_rate()
     print(json.dumps(current, indent=2, ensure_ascii=False))
+    print(f"Current version: {get_custom_rate_version()}")
     
     print("\nTesting rounding...")
     test_values = [4.512, 4.537, 4.563, 4.499, 4.474]
@@ -1,9 +1,12 @@
 import sqlite3
 from datetime import datetime
 import logging
+import threading
+import time
 from contextlib import contextmanager
 
-logging.basicConfig(level=logging.INFO)
+import config
+from metrics import timed, DB_QUERY_SECONDS
 
 DATABASE_PATH = 'exchange_bot.db'
 
@@ -17,6 +20,13 @@ def get_db():
     finally:
         conn.close()
 
+def _add_column_if_missing(cursor, table, column, column_type):
+    """Add a column to a table created by an older version of init_database."""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+@timed(DB_QUERY_SECONDS)
 def init_database():
     """Initialize database tables."""
     with get_db() as conn:
@@ -60,6 +70,11 @@ def init_database():
             )
         ''')
         
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_rate_history_provider_timestamp
+            ON rate_history (provider, timestamp)
+        ''')
+        
         # Admin users table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS admins (
@@ -70,9 +85,78 @@ def init_database():
             )
         ''')
         
+        # Custom rate history (append-only, one row per version)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS custom_rate_history (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                provider TEXT NOT NULL,
+                buying_tt REAL NOT NULL,
+                selling_tt REAL NOT NULL,
+                last_updated_by TEXT,
+                timestamp TIMESTAMP NOT NULL,
+                tiers TEXT
+            )
+        ''')
+        _add_column_if_missing(cursor, 'custom_rate_history', 'tiers', 'TEXT')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_custom_rate_history_timestamp
+            ON custom_rate_history (timestamp)
+        ''')
+        
+        # Latest published rate snapshot, shared by all worker processes
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rate_snapshot (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL,
+                rates TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        
+        # Human support requests relayed to admins (dedupe window + delivery tracking)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS support_requests (
+                request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                content TEXT NOT NULL,
+                message_id INTEGER,
+                created_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_support_requests_user_created
+            ON support_requests (user_id, created_at)
+        ''')
+        
+        # Outgoing LINE pushes/multicasts, delivered (with retries) by the scheduler leader
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                recipients TEXT NOT NULL,
+                text TEXT NOT NULL,
+                retry_key TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                claimed_at REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outbox_status_next_attempt
+            ON outbox (status, next_attempt_at)
+        ''')
+        
+        # WAL lets worker processes read while another one writes
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         conn.commit()
         logging.info("Database initialized successfully")
 
+@timed(DB_QUERY_SECONDS)
 def save_rate_history(rates):
     """Save rate data to history."""
     with get_db() as conn:
@@ -90,6 +174,7 @@ def save_rate_history(rates):
                 ))
         conn.commit()
 
+@timed(DB_QUERY_SECONDS)
 def get_latest_rates():
     """Get the most recent rates for each provider."""
     with get_db() as conn:
@@ -102,13 +187,83 @@ def get_latest_rates():
         ''')
         return [dict(row) for row in cursor.fetchall()]
 
-def is_admin(user_id):
-    """Check if user is an admin."""
+@timed(DB_QUERY_SECONDS)
+def get_rate_history(since, provider=None):
+    """
+    Rate history rows since a datetime, oldest first.
+    
+    Args:
+        since: datetime lower bound (rate_history stores local time)
+        provider: Only this provider (optional)
+    """
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM admins WHERE user_id = ?', (user_id,))
-        return cursor.fetchone() is not None
+        if provider:
+            cursor.execute('''
+                SELECT provider, buying_tt, selling_tt, timestamp
+                FROM rate_history
+                WHERE provider = ? AND timestamp >= ?
+                ORDER BY timestamp
+            ''', (provider, since))
+        else:
+            cursor.execute('''
+                SELECT provider, buying_tt, selling_tt, timestamp
+                FROM rate_history
+                WHERE timestamp >= ?
+                ORDER BY timestamp
+            ''', (since,))
+        return [dict(row) for row in cursor.fetchall()]
+
+# Admin IDs (env list merged with the admins table) kept in memory.
+# State is one tuple swapped atomically: (admin ids, table signature, checked at).
+_admin_state = (frozenset(), None, float('-inf'))
+_admin_lock = threading.Lock()
+
+def _admin_table_signature(cursor):
+    """Cheap fingerprint of the admins table; changes on insert or delete."""
+    cursor.execute('SELECT COUNT(*), MAX(admin_id) FROM admins')
+    return tuple(cursor.fetchone())
+
+@timed(DB_QUERY_SECONDS)
+def _refresh_admin_ids(force=False):
+    """Reload the admin set if the admins table changed (or if forced)."""
+    global _admin_state
+    with _admin_lock:
+        ids, signature, _ = _admin_state
+        try:
+            with get_db() as conn:
+                cursor = conn.cursor()
+                new_signature = _admin_table_signature(cursor)
+                if force or new_signature != signature:
+                    cursor.execute('SELECT user_id FROM admins')
+                    env_ids = [uid.strip() for uid in config.ADMIN_USER_IDS if uid.strip()]
+                    ids = frozenset(env_ids + [row['user_id'] for row in cursor.fetchall()])
+                    signature = new_signature
+        except sqlite3.Error as e:
+            logging.error(f"Failed to refresh admin list: {e}")
+        _admin_state = (ids, signature, time.monotonic())
+        return ids
+
+def get_admin_ids():
+    """
+    Get all admin user IDs as a frozenset.
+    Served from memory; the admins table is re-checked at most every
+    ADMIN_REFRESH_SECONDS to pick up changes made by other processes.
+    """
+    ids, _, checked_at = _admin_state
+    if time.monotonic() - checked_at < config.ADMIN_REFRESH_SECONDS:
+        return ids
+    return _refresh_admin_ids()
+
+def invalidate_admin_cache():
+    """Force the next admin check to reload the admins table."""
+    _refresh_admin_ids(force=True)
+
+def is_admin(user_id):
+    """Check if user is an admin (ADMIN_USER_IDS or the admins table)."""
+    return user_id in get_admin_ids()
 
+@timed(DB_QUERY_SECONDS)
 def add_admin(user_id, user_name=None):
     """Add a user as admin."""
     with get_db() as conn:
@@ -117,10 +272,15 @@ def add_admin(user_id, user_name=None):
             cursor.execute('INSERT INTO admins (user_id, user_name) VALUES (?, ?)', 
                          (user_id, user_name))
             conn.commit()
-            return True
         except sqlite3.IntegrityError:
             return False
+    
+    invalidate_admin_cache()
+    return True
 
 if __name__ == "__main__":
+    from log_config import configure_logging
+    configure_logging()
+    
     init_database()
     print("Database initialized successfully!")
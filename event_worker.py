@@ -0,0 +1,105 @@
+import logging
+import queue
+import threading
+import time
+
+class EventWorkerPool:
+    """
+    Bounded queue plus a fixed set of worker threads.
+
+    submit() never blocks for longer than its timeout: when the queue is full
+    the caller gets False and can push back (e.g. answer 503 so LINE redelivers).
+    """
+
+    def __init__(self, process, workers=4, max_queue=1000, name='webhook'):
+        """
+        Args:
+            process: Callable run by a worker for every submitted item
+            workers: Number of worker threads
+            max_queue: Maximum number of items waiting
+            name: Thread name prefix, used in logs
+        """
+        self.process = process
+        self.workers = workers
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'processed': 0,
+            'failed': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'process_seconds_total': 0.0
+        }
+
+    def start(self):
+        """Start the worker threads (idempotent)."""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, item, timeout=0.5):
+        """
+        Queue an item for processing.
+
+        Returns:
+            True if queued, False if the queue stayed full for timeout seconds
+        """
+        try:
+            self._queue.put((time.monotonic(), item), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+        with self._lock:
+            self._stats['submitted'] += 1
+        return True
+
+    def _run(self):
+        while True:
+            queued_at, item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            started = time.monotonic()
+            wait = started - queued_at
+            failed = False
+            try:
+                self.process(item)
+            except Exception as e:
+                failed = True
+                logging.error(f"{self.name} worker failed: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+            with self._lock:
+                self._stats['processed'] += 1
+                self._stats['failed'] += failed
+                self._stats['wait_seconds_total'] += wait
+                self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], wait)
+                self._stats['process_seconds_total'] += time.monotonic() - started
+
+    def stats(self):
+        """Counters plus current queue depth."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_capacity'] = self._queue.maxsize
+        stats['workers'] = len(self._threads)
+        return stats
+
+    def shutdown(self, wait=True):
+        """Stop the workers after the queued items are done."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put((time.monotonic(), None))
+        if wait:
+            for thread in threads:
+                thread.join()
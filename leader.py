@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; every process acts as leader there
+    fcntl = None
+
+class LeaderLock:
+    """
+    Exclusive, non-blocking flock on a file.
+
+    The OS releases the lock when the holding process exits or crashes, so a
+    waiting process can take over without any heartbeat. Each process must
+    open the file itself (do not acquire before a fork, e.g. gunicorn --preload).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    @property
+    def is_leader(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        """Try once to become leader. Returns True if this process holds the lock."""
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            logging.warning("fcntl not available, running scheduler without leader election")
+            self._fd = -1
+            return True
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        # Record the leader's PID for operators; the lock itself is what counts
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        """Give up leadership."""
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+class LeaderElection:
+    """
+    Runs on_elected() once this process becomes leader.
+
+    start() tries immediately; if another process is leader, a daemon thread
+    keeps retrying every retry_seconds and takes over when the leader dies.
+    """
+
+    def __init__(self, path, on_elected, retry_seconds=15):
+        self.lock = LeaderLock(path)
+        self.on_elected = on_elected
+        self.retry_seconds = retry_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self):
+        return self.lock.is_leader
+
+    def start(self):
+        """Try to become leader now, otherwise wait for the current leader to go away."""
+        if self._try():
+            return True
+        logging.info(f"Another process holds {self.lock.path}, waiting to take over")
+        self._thread = threading.Thread(target=self._wait_for_leadership, name='leader-election', daemon=True)
+        self._thread.start()
+        return False
+
+    def _try(self):
+        if not self.lock.try_acquire():
+            return False
+        logging.info(f"Elected scheduler leader (pid {os.getpid()})")
+        self.on_elected()
+        return True
+
+    def _wait_for_leadership(self):
+        while not self._stop.wait(self.retry_seconds):
+            try:
+                if self._try():
+                    return
+            except Exception as e:
+                logging.error(f"Leader election failed: {e}")
+
+    def stop(self):
+        """Stop waiting and release leadership."""
+        self._stop.set()
+        self.lock.release()
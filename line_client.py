@@ -0,0 +1,56 @@
+import re
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+import config
+from metrics import LINE_API_SECONDS, LINE_API_TOTAL
+
+# User, group and room IDs in API paths (e.g. /v2/bot/profile/U...) would explode label cardinality
+_ID_SEGMENT = re.compile(r'/[UCR][0-9a-f]{32}')
+
+def endpoint_label(url):
+    """Metric label for an API URL: the path with IDs replaced, e.g. /v2/bot/profile/{id}."""
+    return _ID_SEGMENT.sub('/{id}', urlsplit(url).path)
+
+class PooledHttpClient(RequestsHttpClient):
+    """
+    LINE SDK HTTP client on one keep-alive requests.Session (the SDK default opens
+    a new connection per call). Records latency and status of every API call.
+    """
+
+    def __init__(self, timeout=RequestsHttpClient.DEFAULT_TIMEOUT, pool_size=None):
+        super().__init__(timeout)
+        pool_size = pool_size or config.LINE_POOL_SIZE
+        self.session = requests.Session()
+        # api.line.me and api-data.line.me
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _call(self, method, url, timeout=None, **kwargs):
+        endpoint = endpoint_label(url)
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            status = str(response.status_code)
+            return RequestsHttpResponse(response)
+        finally:
+            LINE_API_SECONDS.observe(time.perf_counter() - start, endpoint)
+            LINE_API_TOTAL.inc(endpoint, status)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._call('GET', url, timeout, headers=headers, params=params, stream=stream)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._call('POST', url, timeout, headers=headers, data=data)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._call('PUT', url, timeout, headers=headers, data=data)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._call('DELETE', url, timeout, headers=headers, data=data)
@@ -0,0 +1,436 @@
+# End-to-end load test: signed LINE webhooks replayed against /callback.
+#
+# A local stand-in plays the LINE Messaging API (reply, push, multicast,
+# profile) and the rate providers. By default the bot is started under
+# Gunicorn in a scratch directory, pointed at the stand-in; --target tests a
+# bot that is already running (start it with LINE_API_ENDPOINT and
+# RATE_PROVIDER_BASE_URL set to the stand-in URL printed here).
+#
+#   python loadtest.py                          # 50 msg/s for 30s
+#   python loadtest.py --rate 200 --duration 60 --users 500
+#   python loadtest.py --target http://127.0.0.1:5000 --secret $LINE_CHANNEL_SECRET --stand-in-port 8900
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask, request, jsonify
+
+# (command, message template, weight): messages users send, weighted roughly like
+# production traffic. {amount} is filled per message.
+COMMAND_MIX = [
+    ('rates', '汇率', 35),
+    ('calc', '计算{amount}', 25),
+    ('trend', '走势', 3),
+    ('queue_join', '排队', 6),
+    ('queue_status', '位置', 8),
+    ('queue_leave', '离开', 4),
+    ('alert', '预警 4.{amount}', 3),
+    ('alert_cancel', '取消预警', 2),
+    ('support', '人工 请问今天营业吗', 2),
+    ('help', '你好', 5),
+]
+
+# Admin messages, sent by the admin users
+ADMIN_COMMAND_MIX = [
+    ('view_queue', '队列', 5),
+    ('next', '下一个', 2),
+    ('complete', '完成', 2),
+    ('support_log', '咨询记录', 1),
+]
+
+# Share of messages sent by admin users
+ADMIN_SHARE = 0.05
+
+def sign(body, secret):
+    """X-Line-Signature of a webhook body: base64 HMAC-SHA256 with the channel secret."""
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+def user_id(n):
+    return 'U' + hashlib.md5(f'loadtest-{n}'.encode()).hexdigest()
+
+def text_event(user, text, reply_token):
+    """One text message event, as LINE sends it."""
+    return {
+        'type': 'message',
+        'mode': 'active',
+        'timestamp': int(time.time() * 1000),
+        'source': {'type': 'user', 'userId': user},
+        'webhookEventId': uuid.uuid4().hex.upper(),
+        'deliveryContext': {'isRedelivery': False},
+        'replyToken': reply_token,
+        'message': {'id': str(random.randrange(10 ** 17, 10 ** 18)), 'type': 'text', 'text': text}
+    }
+
+def webhook_body(events):
+    return json.dumps({'destination': 'U' + '0' * 32, 'events': events}, ensure_ascii=False).encode('utf-8')
+
+def pick(mix):
+    """A weighted random (message text, command) from a command mix."""
+    command, template, _ = random.choices(mix, weights=[weight for _, _, weight in mix])[0]
+    return template.format(amount=random.randint(100, 99999)), command
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list (None if empty)."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class StandIn:
+    """
+    Local LINE Messaging API and rate provider stand-in.
+
+    Replies are matched to webhooks by reply token, so the end-to-end time is
+    from sending the webhook to the bot's reply arriving here. Provider rates
+    follow a small random walk, so every refresh publishes a new snapshot.
+    """
+
+    def __init__(self, port=0, latency=0.0):
+        self.latency = latency
+        self.replies = {}  # reply token -> arrival time (perf_counter)
+        self.counts = {'reply': 0, 'push': 0, 'multicast': 0, 'profile': 0, 'provider': 0}
+        self.rate = 4.80
+        self._lock = threading.Lock()
+        self._reply_arrived = threading.Condition(self._lock)
+        self.app = self._build_app()
+
+        from werkzeug.serving import make_server, WSGIRequestHandler
+        # Keep-alive, as the real API supports it; no per-request access log
+        WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self._server = make_server('127.0.0.1', port, self.app, threaded=True)
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='stand-in', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def _count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _rate(self):
+        with self._lock:
+            self.rate = round(max(4.5, min(5.1, self.rate + random.uniform(-0.01, 0.01))), 4)
+            self.counts['provider'] += 1
+            return self.rate
+
+    def wait_for_replies(self, tokens, timeout):
+        """Block until all reply tokens have been answered or timeout passes."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while not all(token in self.replies for token in tokens):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._reply_arrived.wait(remaining)
+            return True
+
+    def _build_app(self):
+        app = Flask('line-stand-in')
+
+        @app.route('/v2/bot/message/reply', methods=['POST'])
+        def reply():
+            arrived = time.perf_counter()
+            self._delay()
+            token = request.get_json(force=True).get('replyToken')
+            with self._lock:
+                self.counts['reply'] += 1
+                self.replies[token] = arrived
+                self._reply_arrived.notify_all()
+            return jsonify({})
+
+        @app.route('/v2/bot/message/push', methods=['POST'])
+        def push():
+            self._delay()
+            self._count('push')
+            return jsonify({})
+
+        @app.route('/v2/bot/message/multicast', methods=['POST'])
+        def multicast():
+            self._delay()
+            self._count('multicast')
+            return jsonify({})
+
+        @app.route('/v2/bot/profile/<user>')
+        def profile(user):
+            self._delay()
+            self._count('profile')
+            return jsonify({'userId': user, 'displayName': f'用户{user[-4:]}', 'pictureUrl': None, 'statusMessage': None})
+
+        # Rate providers (same paths as the real sites, see scraper.py)
+        @app.route('/finance/quote/CNY-THB')
+        def google():
+            return f'<div data-last-price="{self._rate()}"></div>'
+
+        @app.route('/v8/finance/chart/CNYTHB=X')
+        def yahoo():
+            return jsonify({'chart': {'result': [{'meta': {'regularMarketPrice': self._rate()}}]}})
+
+        @app.route('/sourcedb/thb/')
+        def boc_th():
+            rate = self._rate()
+            return f'<table class="data2"><tr><td>CNY</td><td>{rate - 0.03}</td><td>{rate + 0.03}</td></tr></table>'
+
+        @app.route('/v6/latest/CNY')
+        def open_api():
+            return jsonify({'rates': {'THB': self._rate()}})
+
+        return app
+
+# Run the bot under Gunicorn as in production (see Procfile)
+def start_bot(stand_in, secret, admins, port, workers, threads):
+    """Start the bot in a scratch directory against the stand-in. Returns (process, base URL)."""
+    workdir = tempfile.mkdtemp(prefix='exchange_bot_load_')
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.abspath(__file__)),
+        LINE_CHANNEL_ACCESS_TOKEN='loadtest-token',
+        LINE_CHANNEL_SECRET=secret,
+        LINE_API_ENDPOINT=stand_in.url,
+        RATE_PROVIDER_BASE_URL=stand_in.url,
+        ADMIN_USER_IDS=','.join(admins),
+        DATABASE_PATH=os.path.join(workdir, 'exchange_bot.db'),
+        SCHEDULER_LOCK_FILE=os.path.join(workdir, 'scheduler.lock'),
+        REFRESH_LOCK_FILE=os.path.join(workdir, 'refresh.lock'),
+        LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING')
+    )
+    process = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn', 'app:app',
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads)
+    ], cwd=workdir, env=env)
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Bot exited with code {process.returncode}')
+        try:
+            if requests.get(f'{url}/health', timeout=1).ok:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('Bot did not become healthy within 30s')
+
+def wait_for_rates(url, timeout=30):
+    """Wait until the bot has published its first rates from the stand-in providers."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{url}/api/rates', timeout=2).ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+class LoadTest:
+    """
+    Open-loop load: webhooks are sent on a fixed schedule whatever the bot's
+    latency, so a slow bot shows up as latency rather than lower offered load.
+    """
+
+    def __init__(self, url, secret, stand_in, users, admins, rate, duration, concurrency, events_per_request=1):
+        self.url = url.rstrip('/') + '/callback'
+        self.secret = secret
+        self.stand_in = stand_in
+        self.users = users
+        self.admins = admins
+        self.rate = rate
+        self.duration = duration
+        self.events_per_request = events_per_request
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='load')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.sent = []  # (reply token, command, sent at)
+        self.acks = []  # seconds per /callback request
+        self.statuses = {}
+        self.lag = 0.0  # worst delay between a scheduled and actual send
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _message(self):
+        if self.admins and random.random() < ADMIN_SHARE:
+            text, command = pick(ADMIN_COMMAND_MIX)
+            return random.choice(self.admins), text, command
+        text, command = pick(COMMAND_MIX)
+        return random.choice(self.users), text, command
+
+    def _send(self, scheduled):
+        events, sent = [], []
+        for _ in range(self.events_per_request):
+            user, text, command = self._message()
+            token = uuid.uuid4().hex
+            events.append(text_event(user, text, token))
+            sent.append((token, command))
+        body = webhook_body(events)
+        headers = {'Content-Type': 'application/json', 'X-Line-Signature': sign(body, self.secret)}
+
+        start = time.perf_counter()
+        try:
+            response = self._session().post(self.url, data=body, headers=headers, timeout=10)
+            status = str(response.status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.lag = max(self.lag, start - scheduled)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.acks.append(elapsed)
+            if status == '200':
+                self.sent.extend((token, command, start) for token, command in sent)
+
+    def run(self):
+        interval = 1.0 / self.rate
+        start = time.perf_counter()
+        total = int(self.rate * self.duration)
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.pool.submit(self._send, scheduled)
+        self.pool.shutdown(wait=True)
+        return time.perf_counter() - start
+
+def summarise(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': _ms(percentile(values, 50)),
+        'p95_ms': _ms(percentile(values, 95)),
+        'p99_ms': _ms(percentile(values, 99)),
+        'max_ms': _ms(values[-1] if values else None)
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+def report(test, elapsed, drain_seconds):
+    """Latency, throughput and error figures for a finished run."""
+    replies = test.stand_in.replies
+    end_to_end, by_command, missing = [], {}, 0
+    for token, command, sent_at in test.sent:
+        arrived = replies.get(token)
+        if arrived is None:
+            missing += 1
+            continue
+        end_to_end.append(arrived - sent_at)
+        by_command.setdefault(command, []).append(arrived - sent_at)
+
+    requests_sent = sum(test.statuses.values())
+    errors = requests_sent - test.statuses.get('200', 0)
+    events = len(test.sent)
+    return {
+        'offered_rate': test.rate,
+        'duration_s': round(elapsed, 2),
+        'requests': requests_sent,
+        'throughput_rps': round(requests_sent / elapsed, 1) if elapsed else None,
+        'replies_per_s': round(len(end_to_end) / (elapsed + drain_seconds), 1) if end_to_end else 0.0,
+        'http_status': test.statuses,
+        'webhook_error_rate': round(errors / requests_sent, 4) if requests_sent else None,
+        'missing_reply_rate': round(missing / events, 4) if events else None,
+        'max_send_lag_ms': _ms(test.lag),
+        'webhook_ack': summarise(test.acks),
+        'end_to_end': summarise(end_to_end),
+        'by_command': {command: summarise(values) for command, values in sorted(by_command.items())},
+        'line_api_calls': dict(test.stand_in.counts)
+    }
+
+def print_report(result):
+    print(f"\nOffered {result['offered_rate']} req/s for {result['duration_s']}s: "
+          f"{result['requests']} requests, {result['throughput_rps']} req/s sent, "
+          f"{result['replies_per_s']} replies/s")
+    print(f"HTTP status: {result['http_status']}  webhook error rate: {result['webhook_error_rate'] or 0:.2%}  "
+          f"missing replies: {result['missing_reply_rate'] or 0:.2%}  max send lag: {result['max_send_lag_ms']} ms")
+    print(f"\n{'':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = [('webhook ack', result['webhook_ack']), ('end to end', result['end_to_end'])]
+    rows += [(f'  {command}', stats) for command, stats in result['by_command'].items()]
+    for name, stats in rows:
+        cells = ''.join(f"{'-' if stats[key] is None else stats[key]:>10}" for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+        print(f"{name:<20}{stats['count']:>8}{cells}")
+    print(f"\nLINE API calls: {result['line_api_calls']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay signed LINE webhooks against the bot")
+    parser.add_argument('--target', help="Base URL of a running bot (default: start one under Gunicorn)")
+    parser.add_argument('--secret', default=os.getenv('LINE_CHANNEL_SECRET') or 'loadtest-secret',
+                        help="Channel secret used to sign webhooks")
+    parser.add_argument('--rate', type=float, default=50, help="Webhook requests per second")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of load")
+    parser.add_argument('--users', type=int, default=200, help="Distinct simulated users")
+    parser.add_argument('--admins', type=int, default=2, help="Simulated admins (sent admin commands)")
+    parser.add_argument('--events', type=int, default=1, help="Message events per webhook request")
+    parser.add_argument('--concurrency', type=int, default=64, help="Max webhook requests in flight")
+    parser.add_argument('--line-latency', type=float, default=20, help="Stand-in LINE API latency (ms)")
+    parser.add_argument('--stand-in-port', type=int, default=0, help="Stand-in port (default: any free port)")
+    parser.add_argument('--port', type=int, default=5055, help="Port for the bot started here")
+    parser.add_argument('--workers', type=int, default=1, help="Gunicorn workers for the bot started here")
+    parser.add_argument('--threads', type=int, default=64, help="Gunicorn threads for the bot started here")
+    parser.add_argument('--drain', type=float, default=30, help="Max seconds to wait for outstanding replies")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    stand_in = StandIn(args.stand_in_port, args.line_latency / 1000).start()
+    users = [user_id(n) for n in range(args.users)]
+    admins = [user_id(f'admin-{n}') for n in range(args.admins)]
+
+    process = None
+    try:
+        if args.target:
+            url = args.target
+            print(f"LINE/provider stand-in at {stand_in.url}; admin users: {','.join(admins) or '-'}")
+        else:
+            process, url = start_bot(stand_in, args.secret, admins, args.port, args.workers, args.threads)
+        if not wait_for_rates(url):
+            print("Warning: the bot has no rates yet, rate commands will get the fallback reply")
+
+        test = LoadTest(url, args.secret, stand_in, users, admins, args.rate, args.duration,
+                        args.concurrency, args.events)
+        elapsed = test.run()
+        drain_start = time.monotonic()
+        stand_in.wait_for_replies([token for token, _, _ in test.sent], args.drain)
+        result = report(test, elapsed, time.monotonic() - drain_start)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+        stand_in.stop()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+    return 0 if not result['webhook_error_rate'] and not result['missing_reply_rate'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import config
+
+# Attributes every LogRecord has; anything else passed via extra= is a structured field
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any extra fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Merges args into the message before queueing (like the stdlib handler)
+    but keeps extra fields and the traceback separate for the formatter.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_listener = None
+_setup_lock = threading.Lock()
+
+def configure_logging():
+    """
+    Set up logging once for the whole process.
+
+    Request threads only put records on an in-memory queue (QueueHandler);
+    a single listener thread formats and writes them, so log I/O never
+    blocks a request. Safe to call more than once.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        if config.LOG_FORMAT == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        output = logging.StreamHandler()
+        output.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_QueueHandler(log_queue))
+        root.setLevel(config.LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """Log a structured event: the event name is the message, fields become JSON keys."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra=fields)
+
+def sampled(rate=None):
+    """True for roughly `rate` of calls (default LOG_SAMPLE_RATE); used for verbose diagnostics."""
+    if rate is None:
+        rate = config.LOG_SAMPLE_RATE
+    return rate >= 1 or random.random() < rate
+
+class RateLimiter:
+    """
+    Allow a message per key at most once every `interval` seconds.
+    Keys are forgotten once their interval has passed, so per-user keys do not pile up.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._last = OrderedDict()  # key -> time last allowed, oldest first
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            while self._last and now - next(iter(self._last.values())) >= self.interval:
+                self._last.popitem(last=False)
+            if key in self._last:
+                return False
+            self._last[key] = now
+            return True
@@ -0,0 +1,297 @@
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+
+from database import get_db
+from metrics import OUTBOX_TOTAL
+
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Recipients per multicast call (LINE API limit)
+MULTICAST_LIMIT = 500
+
+# A 'sending' row older than this was claimed by a process that died mid-send
+CLAIM_TIMEOUT = 300
+
+# Delivered/failed rows are kept this long for delivery tracking
+KEEP_SECONDS = 7 * 24 * 3600
+
+class TokenBucket:
+    """Allow `rate` calls per second on average, with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting for it if needed. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(error, attempt, base=1.0, cap=300.0):
+    """
+    Seconds to wait before retrying after `error`, or None if it is permanent.
+
+    429 and 5xx responses and network errors are retried with full-jitter
+    exponential backoff; a Retry-After header is a lower bound.
+    """
+    if isinstance(error, LineBotApiError):
+        if error.status_code not in _RETRYABLE_STATUS:
+            return None
+        headers = {k.lower(): v for k, v in (error.headers or {}).items()}
+        retry_after = parse_retry_after(headers.get('retry-after'))
+    else:
+        retry_after = None
+
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, 1))
+    return delay
+
+def _error_text(error):
+    if isinstance(error, LineBotApiError):
+        return f"{error.status_code}: {error.error.message if error.error else error}"
+    return f"{type(error).__name__}: {error}"
+
+class Messenger:
+    """
+    Outbound LINE messages.
+
+    Replies are sent at once (reply tokens expire) with one short retry, and
+    fall back to a queued push. Pushes and multicasts are written to the SQLite
+    outbox and delivered by sender threads in one process (start() is called
+    by the scheduler leader), paced by a token bucket and retried with backoff.
+    Each outbox row has a retry key, so LINE drops duplicates of a message that
+    was sent before a crash or timeout.
+    """
+
+    def __init__(self, api, rate=50, burst=None, workers=2, max_attempts=8, poll_seconds=1.0):
+        self.api = api
+        self.bucket = TokenBucket(rate, burst)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_maintenance = float('-inf')
+
+    def reply(self, reply_token, text, fallback_to=None, max_wait=2.0):
+        """
+        Reply to an event. Retries once if LINE asks to wait at most max_wait
+        seconds, then queues a push to fallback_to (if given).
+
+        Returns:
+            True if the reply was delivered
+        """
+        for attempt in range(2):
+            self.bucket.acquire()
+            try:
+                self.api.reply_message(reply_token, TextSendMessage(text=text))
+                OUTBOX_TOTAL.inc('reply', 'sent')
+                return True
+            except Exception as e:
+                delay = retry_delay(e, attempt, base=0.25)
+                logging.warning(f"Reply failed ({_error_text(e)})")
+                if attempt or delay is None or delay > max_wait:
+                    break
+                time.sleep(delay)
+
+        OUTBOX_TOTAL.inc('reply', 'failed')
+        if fallback_to:
+            self.push(fallback_to, text)
+        return False
+
+    def push(self, to, text):
+        """Queue a push message. Returns the outbox message_id."""
+        return self._enqueue('push', [to], text)
+
+    def multicast(self, to, text):
+        """Queue one multicast to several users (one API call, up to MULTICAST_LIMIT recipients)."""
+        to = list(to)
+        if not 0 < len(to) <= MULTICAST_LIMIT:
+            raise ValueError(f"Multicast needs 1 to {MULTICAST_LIMIT} recipients, got {len(to)}")
+        return self._enqueue('multicast', to, text)
+
+    def _enqueue(self, kind, recipients, text):
+        now = time.time()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO outbox (kind, recipients, text, retry_key, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (kind, json.dumps(recipients), text, str(uuid.uuid4()), now, now))
+            conn.commit()
+            message_id = cursor.lastrowid
+        self._wakeup.set()
+        return message_id
+
+    def delivery_status(self, message_id):
+        """Status of a queued message: pending, sending, sent or failed (None if unknown)."""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT message_id, kind, status, attempts, last_error, created_at, sent_at
+                FROM outbox WHERE message_id = ?
+            ''', (message_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def stats(self):
+        """Outbox row counts by status."""
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+            return {status: count for status, count in cursor.fetchall()}
+
+    def start(self):
+        """Start the sender threads (one process per host should call this)."""
+        if self._threads:
+            return
+        self._stop.clear()
+        self._maintain(force=True)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'outbox-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._maintain()
+                row = self._claim_next()
+            except Exception as e:
+                logging.error(f"Outbox read failed: {e}")
+                row = None
+            if row is None:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+                continue
+            try:
+                self._deliver(row)
+            except Exception as e:
+                # Left in 'sending'; requeued after CLAIM_TIMEOUT
+                logging.error(f"Outbox delivery of {row['message_id']} failed: {e}")
+
+    def _claim_next(self):
+        """Atomically take the next due message (safe across threads and processes)."""
+        now = time.time()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, message_id LIMIT 1
+            ''', (now,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute('''
+                UPDATE outbox SET status = 'sending', claimed_at = ?
+                WHERE message_id = ? AND status = 'pending'
+            ''', (now, row['message_id']))
+            conn.commit()
+            return dict(row) if cursor.rowcount == 1 else None
+
+    def _deliver(self, row):
+        recipients = json.loads(row['recipients'])
+        message = TextSendMessage(text=row['text'])
+        self.bucket.acquire()
+        try:
+            if row['kind'] == 'multicast':
+                self.api.multicast(recipients, message, retry_key=row['retry_key'])
+            else:
+                self.api.push_message(recipients[0], message, retry_key=row['retry_key'])
+        except Exception as e:
+            if isinstance(e, LineBotApiError) and e.status_code == 409:
+                # Retry key already accepted: the message went out on an earlier attempt
+                self._finish(row, 'sent')
+                return
+            attempts = row['attempts'] + 1
+            delay = retry_delay(e, row['attempts'])
+            if delay is None or attempts >= self.max_attempts:
+                logging.error(f"Giving up on {row['kind']} {row['message_id']} after {attempts} attempts: {_error_text(e)}")
+                self._finish(row, 'failed', _error_text(e), attempts)
+            else:
+                logging.warning(f"{row['kind']} {row['message_id']} failed ({_error_text(e)}), retrying in {delay:.1f}s")
+                self._reschedule(row, attempts, delay, _error_text(e))
+            return
+        self._finish(row, 'sent', attempts=row['attempts'] + 1)
+
+    def _finish(self, row, status, error=None, attempts=None):
+        OUTBOX_TOTAL.inc(row['kind'], status)
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE outbox SET status = ?, attempts = ?, last_error = ?, sent_at = ?
+                WHERE message_id = ?
+            ''', (status, attempts if attempts is not None else row['attempts'], error,
+                  time.time() if status == 'sent' else None, row['message_id']))
+            conn.commit()
+
+    def _reschedule(self, row, attempts, delay, error):
+        OUTBOX_TOTAL.inc(row['kind'], 'retry')
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ?
+                WHERE message_id = ?
+            ''', (attempts, time.time() + delay, error, row['message_id']))
+            conn.commit()
+
+    def _maintain(self, force=False):
+        """Every minute: requeue messages orphaned mid-send and prune old delivered/failed rows."""
+        now = time.time()
+        if not force and now - self._last_maintenance < 60:
+            return
+        self._last_maintenance = now
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE outbox SET status = 'pending'
+                WHERE status = 'sending' AND claimed_at < ?
+            ''', (now - CLAIM_TIMEOUT,))
+            cursor.execute('''
+                DELETE FROM outbox
+                WHERE status IN ('sent', 'failed') AND created_at < ?
+            ''', (now - KEEP_SECONDS,))
+            conn.commit()
@@ -0,0 +1,167 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+# Latency buckets in seconds, from a SQLite lookup (~1ms) to a slow provider (15s timeout)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter, optionally split by labels (values passed positionally)."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_label_text(self.labelnames, labels)} {_format_value(value)}"
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets (Prometheus semantics: le = upper bound).
+    observe() is one bisect and a few additions under a lock.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._bounds = [_format_value(float(bound)) for bound in self.buckets] + ['+Inf']
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        """Context manager observing the duration of the block."""
+        return _Timer(self, labels)
+
+    def collect(self):
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self._bounds, values):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labelnames, labels)} {_format_value(values[-1])}"
+            yield f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}"
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+class Gauge:
+    """Value read from a callback at scrape time (queue depth, snapshot age...)."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, func):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        _registry.append(self)
+
+    def collect(self):
+        try:
+            value = self.func()
+        except Exception:
+            return
+        yield f"{self.name} {_format_value(value)}"
+
+def timed(histogram, label=None):
+    """Decorator observing each call's duration, labelled with the function name by default."""
+    def decorator(func):
+        name = label or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorator
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+# Hot-path metrics. Values are per process: with several web workers each keeps its own.
+RATE_FETCH_SECONDS = Histogram(
+    'exchange_bot_rate_fetch_seconds', "Time to fetch one provider's rates", ['provider'])
+RATE_FETCH_TOTAL = Counter(
+    'exchange_bot_rate_fetch_total', "Provider fetches by outcome (success, fallback, error, exception)",
+    ['provider', 'outcome'])
+COMMAND_SECONDS = Histogram(
+    'exchange_bot_command_seconds', "Time to build the reply to a message, by command", ['command'])
+DB_QUERY_SECONDS = Histogram(
+    'exchange_bot_db_query_seconds', "Time spent in SQLite-backed functions", ['function'])
+LINE_API_SECONDS = Histogram(
+    'exchange_bot_line_api_seconds', "LINE Messaging API call latency", ['endpoint'])
+LINE_API_TOTAL = Counter(
+    'exchange_bot_line_api_requests_total', "LINE Messaging API calls by HTTP status ('error' if no response)",
+    ['endpoint', 'status'])
+OUTBOX_TOTAL = Counter(
+    'exchange_bot_outbox_total', "Outbound LINE messages by kind and outcome (sent, retry, failed)",
+    ['kind', 'outcome'])
+JOB_SECONDS = Histogram(
+    'exchange_bot_job_seconds', "Background job run time", ['job'])
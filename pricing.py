@@ -0,0 +1,107 @@
+import math
+from bisect import bisect_right
+
+import numpy as np
+
+class TierTable:
+    """
+    Amount bands compiled into sorted arrays.
+
+    Band i applies to amounts >= thresholds[i] (up to the next threshold).
+    Index 0 is always the zero-adjustment base band, so every amount resolves.
+    """
+    __slots__ = ('thresholds', 'buy_adj', 'sell_adj', '_thresholds_arr', '_buy_arr', '_sell_arr')
+
+    def __init__(self, tiers=()):
+        bands = {0.0: (0.0, 0.0)}
+        for tier in tiers:
+            bands[float(tier['min_amount'])] = (float(tier['buy_adj']), float(tier['sell_adj']))
+        ordered = sorted(bands.items())
+
+        self.thresholds = [t for t, _ in ordered]
+        self.buy_adj = [adj[0] for _, adj in ordered]
+        self.sell_adj = [adj[1] for _, adj in ordered]
+        self._thresholds_arr = np.array(self.thresholds)
+        self._buy_arr = np.array(self.buy_adj)
+        self._sell_arr = np.array(self.sell_adj)
+
+    def __bool__(self):
+        return len(self.thresholds) > 1
+
+    def resolve(self, amount):
+        """
+        Find the band for one amount.
+
+        Returns:
+            (min_amount, buy_adj, sell_adj) of the matching band
+        """
+        idx = max(bisect_right(self.thresholds, amount) - 1, 0)
+        return self.thresholds[idx], self.buy_adj[idx], self.sell_adj[idx]
+
+    def resolve_batch(self, amounts):
+        """
+        Find the bands for an array of amounts in one vectorised step.
+
+        Returns:
+            (buy_adj, sell_adj) arrays aligned with amounts
+        """
+        idx = np.searchsorted(self._thresholds_arr, amounts, side='right') - 1
+        np.maximum(idx, 0, out=idx)
+        return self._buy_arr[idx], self._sell_arr[idx]
+
+    def to_list(self):
+        """Tier list (without the base band) in storage format."""
+        return [
+            {'min_amount': t, 'buy_adj': b, 'sell_adj': s}
+            for t, b, s in zip(self.thresholds[1:], self.buy_adj[1:], self.sell_adj[1:])
+        ]
+
+EMPTY_TIERS = TierTable()
+
+def compile_tiers(tiers):
+    """Compile a stored tier list into a TierTable (EMPTY_TIERS if none)."""
+    if not tiers:
+        return EMPTY_TIERS
+    return TierTable(tiers)
+
+def parse_tiers(text):
+    """
+    Parse an admin tier definition.
+
+    Format: "min_amount:buy_adj[/sell_adj]" separated by commas, e.g.
+    "10000:0.02,50000:0.05/-0.03". sell_adj defaults to -buy_adj
+    (better on both sides for large amounts).
+
+    Returns:
+        Tier list in storage format, sorted by min_amount
+
+    Raises:
+        ValueError: If the text cannot be parsed
+    """
+    tiers = {}
+    for part in text.replace('，', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        min_text, _, adj_text = part.partition(':')
+        buy_text, _, sell_text = adj_text.partition('/')
+        min_amount = float(min_text)
+        buy_adj = float(buy_text)
+        sell_adj = float(sell_text) if sell_text else -buy_adj
+        if not all(math.isfinite(value) for value in (min_amount, buy_adj, sell_adj)):
+            raise ValueError(f"Invalid tier: {part}")
+        if min_amount <= 0 or abs(buy_adj) > 0.5 or abs(sell_adj) > 0.5:
+            raise ValueError(f"Invalid tier: {part}")
+        tiers[min_amount] = {'min_amount': min_amount, 'buy_adj': buy_adj, 'sell_adj': sell_adj}
+    if not tiers:
+        raise ValueError("No tiers given")
+    return [tiers[k] for k in sorted(tiers)]
+
+def format_tiers(tiers):
+    """Human-readable tier list for LINE replies."""
+    if not tiers:
+        return "未设置阶梯价格"
+    lines = []
+    for tier in tiers:
+        lines.append(f"• ≥{tier['min_amount']:,.0f} CNY: 买入 {tier['buy_adj']:+.2f} / 卖出 {tier['sell_adj']:+.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+class ProfileCache:
+    """
+    Bounded LRU cache of LINE display names with a TTL.
+
+    Filled lazily: only commands that show or store a name ask for one.
+    Failed lookups are not cached, so a LINE outage does not pin "User".
+    """
+
+    def __init__(self, maxsize=1000, ttl=3600, default_name="User"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.default_name = default_name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'errors': 0}
+
+    def get(self, user_id, fetch):
+        """
+        Get a display name, calling fetch() on a miss or expired entry.
+
+        Args:
+            user_id: LINE user ID
+            fetch: Zero-argument callable returning the display name
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                name, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(user_id)
+                    self._stats['hits'] += 1
+                    return name
+                del self._entries[user_id]
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+
+        try:
+            name = fetch()
+        except Exception as e:
+            logging.warning(f"Profile lookup failed for {user_id}: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return self.default_name
+
+        with self._lock:
+            self._entries[user_id] = (name, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return name
+
+    def invalidate(self, user_id=None):
+        """Drop one user's entry, or everything if user_id is None."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        """Counters plus current size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
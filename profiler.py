@@ -0,0 +1,187 @@
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import signal
+import threading
+import time
+from datetime import datetime
+
+import config
+
+class ProfilingSession:
+    """
+    Aggregated cProfile stats for the profiled entry points, until either
+    max_calls entry-point calls were sampled or `seconds` have passed.
+    """
+
+    def __init__(self, max_calls=None, seconds=None, directory='profiles'):
+        self.max_calls = max_calls
+        self.seconds = seconds
+        self.directory = directory
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.calls = {}
+        self.stopped = False
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def record(self, name, profile):
+        """Merge one call's profile. Returns True once the session limits are reached."""
+        with self._lock:
+            if self.stopped:
+                return False
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return self._limit_reached()
+
+    def _limit_reached(self):
+        if self.max_calls and sum(self.calls.values()) >= self.max_calls:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def dump(self):
+        """
+        Write <dir>/profile-<time>-<pid>.pstats (for pstats/snakeviz) plus a
+        .txt summary of the top functions by cumulative time.
+
+        Returns:
+            Path of the .pstats file, or None if nothing was sampled
+        """
+        with self._lock:
+            self.stopped = True
+            stats = self._stats
+            calls = dict(self.calls)
+        if stats is None:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.fromtimestamp(self.started_at).strftime('%Y%m%d-%H%M%S')
+        base = os.path.join(self.directory, f"profile-{stamp}-{os.getpid()}")
+        stats.dump_stats(base + '.pstats')
+        with open(base + '.txt', 'w') as f:
+            f.write(f"Sampled calls: {calls}\n\n")
+            stats.stream = f
+            stats.sort_stats('cumulative').print_stats(50)
+        return base + '.pstats'
+
+    def status(self):
+        with self._lock:
+            remaining = None
+            if self.deadline is not None:
+                remaining = max(0.0, round(self.deadline - time.monotonic(), 1))
+            return {
+                'active': not self.stopped,
+                'calls': dict(self.calls),
+                'max_calls': self.max_calls,
+                'seconds_left': remaining
+            }
+
+_session = None
+_session_lock = threading.Lock()
+_last_dump = None
+_local = threading.local()
+
+def profiled(func):
+    """
+    Profile calls to func while a session is running.
+    When profiling is off this costs one global lookup per call. Calls made
+    from inside another profiled call are covered by the outer profile.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _session
+        if session is None or getattr(_local, 'active', False):
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiler is already active in this thread
+            return func(*args, **kwargs)
+        _local.active = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            _local.active = False
+            if session.record(name, profile):
+                stop(session)
+    return wrapper
+
+def start(calls=None, seconds=None):
+    """
+    Start a profiling session (no-op if one is running).
+    Without limits, PROFILE_DEFAULT_CALLS / PROFILE_DEFAULT_SECONDS apply.
+
+    Returns:
+        The session status
+    """
+    global _session
+    if calls is None and seconds is None:
+        calls, seconds = config.PROFILE_DEFAULT_CALLS, config.PROFILE_DEFAULT_SECONDS
+
+    with _session_lock:
+        if _session is None:
+            _session = ProfilingSession(calls, seconds, config.PROFILE_DIR)
+            if seconds:
+                timer = threading.Timer(seconds, stop, args=(_session,))
+                timer.daemon = True
+                timer.start()
+            logging.info(f"Profiling started (calls={calls}, seconds={seconds})")
+        return _session.status()
+
+def stop(session=None):
+    """
+    Stop the running session (or only `session`, if it is still the running one)
+    and dump its stats.
+
+    Returns:
+        Path of the stats file, or None
+    """
+    global _session, _last_dump
+    with _session_lock:
+        if _session is None or (session is not None and session is not _session):
+            return None
+        session, _session = _session, None
+
+    path = session.dump()
+    if path:
+        _last_dump = path
+        logging.info(f"Profiling stopped, stats written to {path}")
+    else:
+        logging.info("Profiling stopped, no calls were sampled")
+    return path
+
+def status():
+    """Current session status plus the last dump path."""
+    session = _session
+    result = session.status() if session else {'active': False}
+    result['last_dump'] = _last_dump
+    return result
+
+def install_signal_handler(signum=getattr(signal, 'SIGUSR2', None)):
+    """
+    Toggle profiling with a signal (default SIGUSR2): start with the default
+    limits, or stop and dump if a session is running. Only possible from the
+    main thread, and not on Windows.
+    """
+    if signum is None:
+        return False
+
+    def toggle(signum, frame):
+        # Work off the signal handler; dumping takes a lock also used by request threads
+        target = stop if _session is not None else start
+        threading.Thread(target=target, name='profiler-toggle', daemon=True).start()
+
+    try:
+        signal.signal(signum, toggle)
+    except ValueError:  # Not the main thread
+        return False
+    return True
@@ -1,9 +1,9 @@
 from database import get_db
+from metrics import timed, DB_QUERY_SECONDS
 from datetime import datetime
 import logging
 
-logging.basicConfig(level=logging.INFO)
-
+@timed(DB_QUERY_SECONDS)
 def join_queue(user_id, user_name, notes=None):
     """
     Add a customer to the queue.
@@ -46,6 +46,7 @@ def join_queue(user_id, user_name, notes=None):
             'position': position
         }
 
+@timed(DB_QUERY_SECONDS)
 def get_position(user_id):
     """
     Get the position of a user in the queue.
@@ -69,6 +70,7 @@ def get_position(user_id):
         
         return None
 
+@timed(DB_QUERY_SECONDS)
 def get_queue_status(user_id):
     """
     Get queue status for a specific user.
@@ -91,6 +93,7 @@ def get_queue_status(user_id):
         'message': f'您前面还有 {ahead} 人 (There are {ahead} people ahead of you)'
     }
 
+@timed(DB_QUERY_SECONDS)
 def get_next_customer():
     """
     Admin function: Get the next customer in queue.
@@ -122,6 +125,7 @@ def get_next_customer():
         
         return dict(customer)
 
+@timed(DB_QUERY_SECONDS)
 def mark_completed(queue_id):
     """
     Admin function: Mark a customer as completed.
@@ -139,6 +143,7 @@ def mark_completed(queue_id):
         
         return True
 
+@timed(DB_QUERY_SECONDS)
 def get_full_queue():
     """
     Admin function: Get the entire queue.
@@ -154,6 +159,7 @@ def get_full_queue():
         
         return [dict(row) for row in cursor.fetchall()]
 
+@timed(DB_QUERY_SECONDS)
 def leave_queue(user_id):
     """
     Allow a user to leave the queue.
@@ -172,6 +178,9 @@ def leave_queue(user_id):
         return deleted > 0
 
 if __name__ == "__main__":
+    from log_config import configure_logging
+    configure_logging()
+    
     # Test
     from database import init_database
     init_database()
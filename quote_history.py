@@ -0,0 +1,273 @@
+import logging
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+class QuoteRing:
+    """
+    Fixed-capacity ring of one provider's quotes, oldest first: epoch seconds
+    in array('q'), buying and selling rates in array('d') (24 bytes a quote,
+    against several hundred for a sqlite3.Row or dict with a datetime).
+
+    Quotes are appended in time order, so time ranges are found by binary search.
+    """
+    __slots__ = ('capacity', 'count', '_next', '_timestamps', '_buying', '_selling')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.count = 0
+        self._next = 0  # physical slot of the next append
+        self._timestamps = array('q', bytes(8 * capacity))
+        self._buying = array('d', bytes(8 * capacity))
+        self._selling = array('d', bytes(8 * capacity))
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, buying, selling=None):
+        """Add a quote, overwriting the oldest when full. Quotes older than the newest are ignored."""
+        timestamp = int(timestamp)
+        if self.count and timestamp < self._timestamps[self._physical(self.count - 1)]:
+            return False
+        slot = self._next
+        self._timestamps[slot] = timestamp
+        self._buying[slot] = buying
+        self._selling[slot] = selling if selling is not None else buying
+        self._next = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return True
+
+    def _physical(self, index):
+        """Physical slot of the index-th oldest quote."""
+        return (self._next - self.count + index) % self.capacity
+
+    def _find(self, timestamp):
+        """Index of the first quote at or after timestamp."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[self._physical(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _slice(self, column, start, stop):
+        """Copy of column[start:stop] in logical order (at most two C-level slices)."""
+        if start >= stop:
+            return column[:0]
+        first, last = self._physical(start), self._physical(stop - 1) + 1
+        if first < last:
+            return column[first:last]
+        return column[first:self.capacity] + column[:last]
+
+    def _range(self, since, until):
+        start = self._find(int(since)) if since is not None else 0
+        stop = self._find(int(until) + 1) if until is not None else self.count
+        return start, stop
+
+    def oldest(self):
+        """(timestamp, buying, selling) of the oldest quote still held, or None."""
+        if not self.count:
+            return None
+        slot = self._physical(0)
+        return self._timestamps[slot], self._buying[slot], self._selling[slot]
+
+    def latest(self):
+        """(timestamp, buying, selling) of the newest quote, or None."""
+        if not self.count:
+            return None
+        slot = self._physical(self.count - 1)
+        return self._timestamps[slot], self._buying[slot], self._selling[slot]
+
+    def window(self, since=None, until=None):
+        """
+        Quotes between two epoch times (inclusive), as columns.
+
+        Returns:
+            (timestamps array('q'), buying array('d'), selling array('d'))
+        """
+        start, stop = self._range(since, until)
+        return (
+            self._slice(self._timestamps, start, stop),
+            self._slice(self._buying, start, stop),
+            self._slice(self._selling, start, stop)
+        )
+
+    def aggregate(self, since=None, until=None):
+        """Summary of buying rates in a time range: count, first, last, min, max, mean, change; None if empty."""
+        timestamps, buying, _ = self.window(since, until)
+        if not buying:
+            return None
+        return {
+            'count': len(buying),
+            'from': timestamps[0],
+            'to': timestamps[-1],
+            'first': buying[0],
+            'last': buying[-1],
+            'min': min(buying),
+            'max': max(buying),
+            'mean': sum(buying) / len(buying),
+            'change': buying[-1] - buying[0]
+        }
+
+    def resample(self, seconds, since=None, until=None):
+        """
+        Buying rates in fixed time buckets, for charts.
+
+        Returns:
+            [(bucket start, open, high, low, close)] for buckets that have quotes
+        """
+        timestamps, buying, _ = self.window(since, until)
+        buckets = []
+        current = None
+        for timestamp, rate in zip(timestamps, buying):
+            start = timestamp - timestamp % seconds
+            if current is None or current[0] != start:
+                current = [start, rate, rate, rate, rate]
+                buckets.append(current)
+            else:
+                current[2] = max(current[2], rate)
+                current[3] = min(current[3], rate)
+                current[4] = rate
+        return [tuple(bucket) for bucket in buckets]
+
+    def first_crossing(self, target, condition='above', since=None):
+        """
+        Epoch time of the first quote whose buying rate reached target
+        (>= for 'above', <= for 'below'), or None. For alert backtesting.
+        """
+        timestamps, buying, _ = self.window(since)
+        for timestamp, rate in zip(timestamps, buying):
+            if rate >= target if condition == 'above' else rate <= target:
+                return timestamp
+        return None
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (self._timestamps, self._buying, self._selling))
+
+class QuoteHistory:
+    """
+    Recent quotes of every provider in memory, so charts, trends and alert
+    backtests never query rate_history.
+
+    Seeded from rate_history at startup, then fed by every new snapshot:
+    sync() adds the rates of a newer rates_version; a process that skipped
+    refreshes (it served no requests meanwhile) catches up from rate_history.
+    Listeners registered with on_quote() see every quote added, in order.
+    """
+
+    def __init__(self, capacity, days):
+        self.capacity = capacity
+        self.days = days
+        self._rings = {}
+        self._listeners = []
+        self._rates_version = None
+        self._last_quote = None  # epoch seconds of the newest quote added
+        self._lock = threading.Lock()
+
+    def on_quote(self, callback):
+        """Register callback(provider, timestamp, buying, selling), run for every quote added."""
+        self._listeners.append(callback)
+        return callback
+
+    def _add(self, provider, timestamp, buying, selling):
+        ring = self._rings.get(provider)
+        if ring is None:
+            ring = self._rings[provider] = QuoteRing(self.capacity)
+        if not ring.append(timestamp, buying, selling):
+            return
+        for callback in self._listeners:
+            callback(provider, timestamp, buying, selling)
+
+    def _add_rows(self, rows):
+        """Add rate_history rows (oldest first)."""
+        for row in rows:
+            if not row.get('buying_tt'):
+                continue
+            # rate_history stores local datetime.now() values
+            timestamp = datetime.fromisoformat(str(row['timestamp'])).timestamp()
+            self._add(row['provider'], timestamp, row['buying_tt'], row.get('selling_tt'))
+            self._last_quote = max(self._last_quote or 0, timestamp)
+
+    def seed(self, load_history, snapshot=None):
+        """
+        Fill the rings with the last `days` of rate history, e.g. seed(get_rate_history, snapshot).
+        History is saved before a snapshot is published, so the current snapshot
+        (if given) is already included and is not added again by sync().
+        """
+        rows = load_history(datetime.now() - timedelta(days=self.days))
+        with self._lock:
+            self._add_rows(rows)
+            if snapshot is not None and not snapshot.is_empty():
+                self._rates_version = snapshot.rates_version
+        logging.info(f"Quote history seeded from {len(rows)} history rows")
+
+    def sync(self, snapshot, load_history=None):
+        """
+        Take in the rates of a newer snapshot (cheap no-op when nothing changed).
+        If rates versions were skipped and load_history is given, the missing
+        refreshes are read from rate_history instead.
+        """
+        if snapshot.is_empty() or snapshot.rates_version == self._rates_version:
+            return
+        with self._lock:
+            if snapshot.rates_version == self._rates_version:
+                return
+            skipped = self._rates_version is not None and snapshot.rates_version > self._rates_version + 1
+            if skipped and load_history is not None and self._last_quote is not None:
+                try:
+                    self._add_rows(load_history(datetime.fromtimestamp(self._last_quote) + timedelta(microseconds=1)))
+                    self._rates_version = snapshot.rates_version
+                    return
+                except Exception as e:
+                    logging.error(f"Quote history catch-up failed: {e}")
+            for rate in snapshot.rates:
+                if rate.get('status') in ('success', 'fallback') and rate.get('buying_tt'):
+                    self._add(rate['provider'], snapshot.created_at, rate['buying_tt'], rate.get('selling_tt'))
+            self._last_quote = snapshot.created_at
+            self._rates_version = snapshot.rates_version
+
+    def ring(self, provider):
+        """
+        The QuoteRing of a provider, or None. Not safe to read while another
+        thread may sync; request handlers use window() instead.
+        """
+        return self._rings.get(provider)
+
+    def window(self, provider, since=None, until=None):
+        """
+        A provider's quotes between two epoch times, copied under the lock so a
+        concurrent sync cannot shift one column against another.
+
+        Returns:
+            (timestamps, buying, selling) arrays as QuoteRing.window, or None if the provider has no ring
+        """
+        with self._lock:
+            ring = self._rings.get(provider)
+            return ring.window(since, until) if ring is not None else None
+
+    def providers(self):
+        return list(self._rings)
+
+    def covers(self, since, providers=None):
+        """
+        True if the rings hold everything since this epoch time: it is within the
+        retained days, and no ring (of these providers, default all) is full with
+        its oldest quote at or after it, i.e. may have overwritten quotes since then.
+        """
+        if since < (datetime.now() - timedelta(days=self.days)).timestamp():
+            return False
+        for provider in self.providers() if providers is None else providers:
+            ring = self._rings.get(provider)
+            if ring is not None and len(ring) == ring.capacity and ring.oldest()[0] >= since:
+                return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'providers': len(self._rings),
+                'quotes': sum(len(ring) for ring in self._rings.values()),
+                'bytes': sum(ring.nbytes() for ring in self._rings.values())
+            }
@@ -0,0 +1,117 @@
+import io
+import math
+
+import numpy as np
+
+# Upper bound on amounts per batch request (a full 1..100,000 sheet in steps of 1)
+MAX_BATCH_SIZE = 100000
+
+class QuoteError(ValueError):
+    """Invalid batch quote request."""
+
+def price_sheet_amounts(start=1000, stop=100000, step=1000, max_size=MAX_BATCH_SIZE):
+    """
+    Amounts for a price sheet, from start to stop inclusive (at most max_size).
+
+    Returns:
+        1-D float array of CNY amounts
+    """
+    if not all(math.isfinite(value) for value in (start, stop, step)):
+        raise QuoteError("start, stop and step must be finite numbers")
+    if step <= 0 or start <= 0 or stop < start:
+        raise QuoteError("Require 0 < start <= stop and step > 0")
+    count = int((stop - start) // step) + 1
+    if count > max_size:
+        raise QuoteError(f"At most {max_size} amounts per request")
+    return start + step * np.arange(count, dtype=float)
+
+def parse_amounts(values, max_size=MAX_BATCH_SIZE):
+    """
+    Validate a list of amounts from a request (at most max_size).
+
+    Returns:
+        1-D float array of CNY amounts
+    """
+    try:
+        amounts = np.asarray(values, dtype=float).ravel()
+    except (TypeError, ValueError):
+        raise QuoteError("Amounts must be numbers")
+    if amounts.size == 0:
+        raise QuoteError("Provide at least one amount")
+    if amounts.size > max_size:
+        raise QuoteError(f"At most {max_size} amounts per request")
+    if not np.all(np.isfinite(amounts)) or np.any(amounts <= 0):
+        raise QuoteError("Amounts must be greater than 0")
+    return amounts
+
+def build_quotes(amounts, display_rates, best_market, tier_table=None):
+    """
+    Compute an amounts x providers quote matrix in one pass.
+
+    Args:
+        amounts: 1-D array of CNY amounts
+        display_rates: Rates in display order (custom rate first), e.g. snapshot.display_rates
+        best_market: Best public market rate dictionary (snapshot.best_buy)
+        tier_table: Compiled amount tiers applied to the custom rate column (optional)
+
+    Returns:
+        Dictionary with providers, buying rates, THB matrix and the
+        difference of each quote against the best market rate
+    """
+    providers = [r['provider'] for r in display_rates]
+    buying = np.array([r['buying_tt'] for r in display_rates], dtype=float)
+    best_rate = best_market['buying_tt'] if best_market else float(buying.max(initial=0.0))
+
+    amounts = np.asarray(amounts, dtype=float)
+    rate_matrix = np.broadcast_to(buying, (amounts.size, buying.size))
+
+    custom_cols = [i for i, r in enumerate(display_rates) if r.get('status') == 'custom']
+    if tier_table and custom_cols:
+        buy_adj, _ = tier_table.resolve_batch(amounts)
+        rate_matrix = rate_matrix.copy()
+        rate_matrix[:, custom_cols] += buy_adj[:, None]
+
+    thb = amounts[:, None] * rate_matrix
+    diff_vs_best = amounts[:, None] * (rate_matrix - best_rate)
+
+    return {
+        'providers': providers,
+        'buying_tt': buying,
+        'best_provider': best_market['provider'] if best_market else None,
+        'best_rate': best_rate,
+        'amounts': amounts,
+        'thb': thb,
+        'diff_vs_best': diff_vs_best
+    }
+
+def quotes_to_dict(quotes):
+    """Columnar, JSON-serialisable form of build_quotes output."""
+    return {
+        'providers': quotes['providers'],
+        'buying_tt': quotes['buying_tt'].tolist(),
+        'best_market': {'provider': quotes['best_provider'], 'buying_tt': quotes['best_rate']},
+        'amounts': quotes['amounts'].tolist(),
+        'thb': np.round(quotes['thb'], 2).tolist(),
+        'diff_vs_best': np.round(quotes['diff_vs_best'], 2).tolist()
+    }
+
+def quotes_to_csv(quotes):
+    """
+    CSV price sheet: one row per amount, THB and difference vs best per provider.
+    """
+    header = ['amount_cny']
+    for provider in quotes['providers']:
+        header.append(f"{provider} THB")
+        header.append(f"{provider} 差额")
+
+    n_amounts = quotes['amounts'].size
+    n_providers = len(quotes['providers'])
+    table = np.empty((n_amounts, 1 + 2 * n_providers))
+    table[:, 0] = quotes['amounts']
+    table[:, 1::2] = quotes['thb']
+    table[:, 2::2] = quotes['diff_vs_best']
+
+    buffer = io.StringIO()
+    buffer.write(','.join(f'"{h}"' for h in header) + '\n')
+    np.savetxt(buffer, table, fmt='%.2f', delimiter=',')
+    return buffer.getvalue()
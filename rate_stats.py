@@ -0,0 +1,249 @@
+import math
+import threading
+import time
+from array import array
+from collections import deque
+
+# Samples needed before a percentile rank is meaningful enough to label rates with
+MIN_SAMPLES = 12
+
+# Percentile rank buckets: rates within one step of each other count as equal.
+# The step widens if a series spans more than MAX_BUCKETS of them (outliers).
+PERCENTILE_STEP = 0.0001
+MAX_BUCKETS = 1 << 14
+
+class RollingWindow:
+    """
+    Rolling statistics over the samples of one rate series from the last
+    `seconds`, however often they arrive; the EWMA decays by elapsed time too.
+
+    Samples live in array ring buffers of `capacity` (the most the window can
+    hold at the fastest refresh cadence); adding one expires samples that
+    fell out of the window and updates the EWMA, the sums of log returns
+    (volatility) and the monotonic min/max queues in O(1) amortised.
+    Percentile rank uses a Fenwick tree of sample counts per rate bucket,
+    O(log buckets) per add and query; the buckets are re-laid (O(window))
+    only when a rate leaves their range, or once per lap if the range has
+    become much wider than the window's.
+    """
+    __slots__ = (
+        'seconds', 'ewma_seconds', 'capacity', 'count', 'added', 'last', 'last_time', 'ewma',
+        '_timestamps', '_values', '_returns', '_return_sum', '_return_sq', '_tree', '_base', '_step',
+        '_min', '_max'
+    )
+
+    def __init__(self, seconds, ewma_seconds, capacity):
+        self.seconds = seconds
+        self.ewma_seconds = ewma_seconds
+        self.capacity = capacity
+        self.count = 0    # samples in the window
+        self.added = 0    # samples ever added (position of the next one)
+        self.last = None
+        self.last_time = None
+        self.ewma = None
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        self._returns = array('d', bytes(8 * capacity))
+        self._return_sum = 0.0
+        self._return_sq = 0.0
+        self._tree = array('q', [0])  # Fenwick tree, 1-based: counts per bucket
+        self._base = 0.0               # rate at the centre of bucket 0
+        self._step = PERCENTILE_STEP
+        self._min = deque()  # (position, value), values increasing
+        self._max = deque()  # (position, value), values decreasing
+
+    def add(self, timestamp, value):
+        """Add one sample taken at an epoch time (not older than the last one)."""
+        self.expire(timestamp)
+        if self.count == self.capacity:
+            self._evict()
+        position = self.added
+        slot = position % self.capacity
+        change = math.log(value / self.last) if self.last else 0.0
+        self._timestamps[slot] = timestamp
+        self._values[slot] = value
+        self._returns[slot] = change
+        self._return_sum += change
+        self._return_sq += change * change
+        self.count += 1
+        self.added += 1
+        bucket = self._bucket(value)
+        if 0 <= bucket < len(self._tree) - 1:
+            self._count_bucket(bucket, 1)
+        else:
+            self._rebucket()
+
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((position, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((position, value))
+
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            # Weight of the new sample grows with the time since the last one
+            # (2 / (span + 1) per sample at a steady cadence)
+            elapsed = max(timestamp - self.last_time, 0.0)
+            self.ewma += (1 - math.exp(-2 * elapsed / self.ewma_seconds)) * (value - self.ewma)
+        self.last = value
+        self.last_time = timestamp
+        if slot == self.capacity - 1:
+            # Once per lap: drop the floating-point drift of the running sums
+            self._resum()
+            if len(self._tree) - 1 > 2 * self._layout(self.minimum, self.maximum)[2]:
+                self._rebucket()
+
+    def expire(self, now):
+        """Drop samples older than the window at epoch time now."""
+        cutoff = now - self.seconds
+        while self.count and self._timestamps[(self.added - self.count) % self.capacity] <= cutoff:
+            self._evict()
+
+    def _evict(self):
+        """Drop the oldest sample."""
+        slot = (self.added - self.count) % self.capacity
+        old_value, old_return = self._values[slot], self._returns[slot]
+        self._count_bucket(self._bucket(old_value), -1)
+        self._return_sum -= old_return
+        self._return_sq -= old_return * old_return
+        self.count -= 1
+        oldest = self.added - self.count
+        for queue in (self._min, self._max):
+            while queue and queue[0][0] < oldest:
+                queue.popleft()
+
+    def _window(self, column):
+        """Copy of a column's samples in the window, oldest first."""
+        first = (self.added - self.count) % self.capacity
+        last = first + self.count
+        if last <= self.capacity:
+            return column[first:last]
+        return column[first:] + column[:last - self.capacity]
+
+    def _resum(self):
+        returns = self._window(self._returns)
+        self._return_sum = math.fsum(returns)
+        self._return_sq = math.fsum(r * r for r in returns)
+
+    def _layout(self, low, high):
+        """(base, step, buckets) covering [low, high] with room to drift either way."""
+        span = high - low
+        step = max(PERCENTILE_STEP, 2 * span / MAX_BUCKETS)
+        margin = span / 2 + 64 * step
+        # On the step grid, so rates a step apart never share a bucket
+        base = math.floor((low - margin) / step) * step
+        return base, step, int((high + margin - base) / step) + 2
+
+    def _rebucket(self):
+        """Lay the buckets out afresh around the window's samples and recount them."""
+        values = self._window(self._values)
+        self._base, self._step, buckets = self._layout(min(values), max(values))
+        tree = array('q', bytes(8 * (buckets + 1)))
+        for value in values:
+            tree[self._bucket(value) + 1] += 1
+        for i in range(1, buckets + 1):
+            parent = i + (i & -i)
+            if parent <= buckets:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _bucket(self, value):
+        return math.floor((value - self._base) / self._step + 0.5)
+
+    def _count_bucket(self, bucket, delta):
+        tree = self._tree
+        i = bucket + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _count_upto(self, bucket):
+        """Samples in buckets 0..bucket."""
+        tree = self._tree
+        i = min(bucket + 1, len(tree) - 1)
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    @property
+    def minimum(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def maximum(self):
+        return self._max[0][1] if self._max else None
+
+    def volatility(self):
+        """Standard deviation of log returns between samples in the window (0.001 = 0.1%)."""
+        # The oldest sample's return points outside the window (or is the 0.0 of the first sample)
+        n = self.count - 1
+        if n < 2:
+            return None
+        oldest = self._returns[(self.added - self.count) % self.capacity]
+        total, squares = self._return_sum - oldest, self._return_sq - oldest * oldest
+        variance = (squares - total * total / n) / (n - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def percentile(self, value=None):
+        """Percentile rank (0-100) of value, by default the latest sample, within the window."""
+        if not self.count:
+            return None
+        value = self.last if value is None else value
+        bucket = self._bucket(value)
+        below = self._count_upto(bucket - 1)
+        equal = self._count_upto(bucket) - below
+        return 100.0 * (below + 0.5 * equal) / self.count
+
+    def summary(self):
+        return {
+            'last': self.last,
+            'ewma': self.ewma,
+            'min': self.minimum,
+            'max': self.maximum,
+            'volatility': self.volatility(),
+            'percentile': self.percentile(),
+            'samples': self.count
+        }
+
+class RateStatistics:
+    """
+    Live rolling statistics of the buying rate per provider, never recomputed
+    from the database. Fed one quote at a time, e.g. as a QuoteHistory listener:
+    quote_history.on_quote(rate_stats.add). Windows and the EWMA span are in
+    seconds; capacity bounds the samples a window can hold.
+    """
+
+    def __init__(self, seconds, ewma_seconds, capacity):
+        self.seconds = seconds
+        self.ewma_seconds = ewma_seconds
+        self.capacity = capacity
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def add(self, provider, timestamp, buying, selling=None):
+        with self._lock:
+            series = self._series.get(provider)
+            if series is None:
+                series = self._series[provider] = RollingWindow(self.seconds, self.ewma_seconds, self.capacity)
+            series.add(timestamp, buying)
+
+    def get(self, provider):
+        """Summary dict for a provider (see RollingWindow.summary), or None if never seen."""
+        with self._lock:
+            series = self._series.get(provider)
+            if series is None:
+                return None
+            series.expire(time.time())
+            return series.summary()
+
+    def percentile(self, provider, value=None):
+        with self._lock:
+            series = self._series.get(provider)
+            if series is None:
+                return None
+            series.expire(time.time())
+            return series.percentile(value)
@@ -0,0 +1,176 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import rates_api
+
+def rate_state(snapshot):
+    """Comparable public state of a snapshot: rates by provider plus market best, tiers and staleness."""
+    view = rates_api.snapshot_to_dict(snapshot)
+    view['rates'] = {r['provider']: r for r in view['rates']}
+    return view
+
+def diff_states(old, new):
+    """
+    Compact delta between two rate states, or None if nothing visible changed.
+    Rates map provider -> new rate, or None for a provider that disappeared.
+    """
+    rates = {p: r for p, r in new['rates'].items() if old['rates'].get(p) != r}
+    rates.update({p: None for p in old['rates'] if p not in new['rates']})
+
+    delta = {}
+    if rates:
+        delta['rates'] = rates
+    for key in ('best_market', 'tiers', 'stale'):
+        if old[key] != new[key]:
+            delta[key] = new[key]
+    if not delta:
+        return None
+    delta['updated_at'] = new['updated_at']
+    return delta
+
+# Client reconnect delay sent with every stream (milliseconds)
+RETRY_MS = 3000
+
+def format_event(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+class Subscriber:
+    """One SSE client: a bounded buffer of formatted events."""
+
+    def __init__(self, buffer_size):
+        self.events = queue.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+    def push(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # A client this far behind is dropped; it resumes with Last-Event-ID
+            self.overflowed = True
+
+class RateStream:
+    """
+    Fan-out of rate changes to Server-Sent Events clients.
+
+    While anyone is subscribed, a watcher thread checks the snapshot every
+    poll_seconds and broadcasts a delta event when the visible rates changed.
+    Event IDs are the shared rates/custom-rate versions, so a client can resume
+    on any worker: recent events are replayed from a short history, otherwise
+    it gets a full snapshot event.
+    """
+
+    def __init__(self, get_snapshot, poll_seconds=2, heartbeat_seconds=15,
+                 buffer_size=16, history_size=64, max_clients=48):
+        self.get_snapshot = get_snapshot
+        self.poll_seconds = poll_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.buffer_size = buffer_size
+        self.max_clients = max_clients
+        self._history = deque(maxlen=history_size)  # (event id, formatted event)
+        self._subscribers = set()
+        self._state = None
+        self._state_id = None
+        self._version = None
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def event_id(snapshot):
+        return f"{snapshot.rates_version}.{snapshot.custom_version}"
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a client, queueing what it missed.
+
+        Returns:
+            Subscriber, or None if this worker is at max_clients
+        """
+        snapshot = self.get_snapshot()
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            self._update(snapshot)
+
+            subscriber = Subscriber(self.buffer_size)
+            ids = [event_id for event_id, _ in self._history]
+            if last_event_id is not None and last_event_id == self._state_id:
+                pass  # Already up to date
+            elif last_event_id is not None and last_event_id in ids:
+                for _, event in list(self._history)[ids.index(last_event_id) + 1:]:
+                    subscriber.push(event)
+            elif self._state is not None:
+                subscriber.push(self._full_event())
+
+            self._subscribers.add(subscriber)
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='rate-stream', daemon=True)
+                self._watcher.start()
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stream(self, subscriber):
+        """Generator of SSE text for one client; heartbeats keep idle connections open."""
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while not subscriber.overflowed:
+                try:
+                    yield subscriber.events.get(timeout=self.heartbeat_seconds)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), 'history': len(self._history), 'event_id': self._state_id}
+
+    def _full_event(self):
+        return format_event(self._state_id, 'snapshot', json.dumps(self._raw_state(), ensure_ascii=False, separators=(',', ':')))
+
+    def _raw_state(self):
+        state = dict(self._state)
+        state['rates'] = list(state['rates'].values())
+        return state
+
+    def _update(self, snapshot):
+        """Take in a new snapshot (caller holds the lock); broadcast if visible rates changed."""
+        if snapshot.is_empty() or snapshot.version == self._version:
+            return
+        self._version = snapshot.version
+        state = rate_state(snapshot)
+        if self._state is None:
+            # First rates since startup: clients that connected early get the full state
+            self._state, self._state_id = state, self.event_id(snapshot)
+            event = self._full_event()
+            for subscriber in self._subscribers:
+                subscriber.push(event)
+            return
+
+        delta = diff_states(self._state, state)
+        if delta is None:
+            return
+        self._state, self._state_id = state, self.event_id(snapshot)
+        event = format_event(self._state_id, 'delta', json.dumps(delta, ensure_ascii=False, separators=(',', ':')))
+        self._history.append((self._state_id, event))
+        for subscriber in self._subscribers:
+            subscriber.push(event)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                snapshot = self.get_snapshot()
+                with self._lock:
+                    if not self._subscribers:
+                        self._watcher = None
+                        return
+                    self._update(snapshot)
+            except Exception as e:
+                logging.error(f"Rate stream watcher failed: {e}")
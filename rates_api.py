@@ -0,0 +1,78 @@
+import hashlib
+import json
+import time
+from datetime import datetime
+
+# Fields of a rate exposed over HTTP (internal fields such as tiers or version stay private)
+RATE_FIELDS = ('provider', 'buying_tt', 'selling_tt', 'status')
+
+# History window limits for /api/rates/history (hours)
+DEFAULT_HISTORY_HOURS = 24
+MAX_HISTORY_HOURS = 24 * 30
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+def public_rate(rate):
+    """The exposed fields of one rate dictionary."""
+    return {field: rate.get(field) for field in RATE_FIELDS}
+
+def snapshot_to_dict(snapshot):
+    """
+    Public view of a snapshot: display rates (custom rate first), the market
+    best and the custom rate's amount tiers.
+    """
+    best = snapshot.best_buy
+    return {
+        'updated_at': _iso(snapshot.created_at),
+        'stale': snapshot.stale,
+        'rates': [public_rate(r) for r in snapshot.display_rates],
+        'best_market': {'provider': best['provider'], 'buying_tt': best['buying_tt']} if best else None,
+        'tiers': snapshot.tier_table.to_list()
+    }
+
+def history_to_dict(rows, hours):
+    """Columnar history per provider, from get_rate_history rows (oldest first)."""
+    providers = {}
+    for row in rows:
+        series = providers.get(row['provider'])
+        if series is None:
+            series = providers[row['provider']] = {'timestamp': [], 'buying_tt': [], 'selling_tt': []}
+        series['timestamp'].append(row['timestamp'][:19])
+        series['buying_tt'].append(row['buying_tt'])
+        series['selling_tt'].append(row['selling_tt'])
+    return {'hours': hours, 'providers': providers}
+
+def windows_to_dict(windows, hours):
+    """Same columnar history as history_to_dict, from QuoteHistory.window() columns (provider -> columns)."""
+    providers = {}
+    for provider, (timestamps, buying, selling) in windows.items():
+        if timestamps:
+            providers[provider] = {
+                'timestamp': [datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') for t in timestamps],
+                'buying_tt': buying.tolist(),
+                'selling_tt': selling.tolist()
+            }
+    return {'hours': hours, 'providers': providers}
+
+def serialise(payload):
+    """
+    Encode a payload once for many responses.
+
+    Returns:
+        (UTF-8 JSON body, strong ETag). The ETag is a hash of the body, so every
+        worker process computes the same one for the same data.
+    """
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return body, hashlib.blake2b(body, digest_size=16).hexdigest()
+
+def max_age(snapshot, refresh_interval, soft_ttl=0, now=None):
+    """
+    Seconds clients may cache rates: until the earliest time the next refresh
+    can publish (the scheduled interval, or the on-demand soft TTL if shorter).
+    """
+    if snapshot.stale:
+        return 0
+    horizon = min(refresh_interval, soft_ttl) if soft_ttl > 0 else refresh_interval
+    remaining = snapshot.created_at + horizon - (now if now is not None else time.time())
+    return max(0, int(remaining))
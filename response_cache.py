@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+class ResponseCache:
+    """
+    Cache of rendered replies (LINE texts, serialised API bodies) keyed by
+    (snapshot version, custom-rate version, command).
+
+    Rendered text only changes when the rates or the custom rate change, so the
+    whole cache is dropped as soon as either version moves on. Size is bounded
+    because calculation commands carry arbitrary amounts.
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = None
+        self._lock = threading.Lock()
+
+    def get_or_render(self, snapshot_version, custom_version, command, render):
+        """
+        Return the cached text for command, calling render() on a miss.
+
+        Args:
+            snapshot_version: Version of the rate snapshot used to render
+            custom_version: Version of the custom rate used to render
+            command: Hashable command key, e.g. 'rates' or ('calc', 5000.0)
+            render: Zero-argument callable producing the text
+        """
+        versions = (snapshot_version, custom_version)
+        key = (snapshot_version, custom_version, command)
+
+        with self._lock:
+            if versions != self._versions:
+                self._entries.clear()
+                self._versions = versions
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+
+        # Render outside the lock; concurrent misses just render twice
+        text = render()
+
+        with self._lock:
+            if versions == self._versions:
+                self._entries[key] = text
+                if len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return text
+
+    def clear(self):
+        """Drop all cached responses."""
+        with self._lock:
+            self._entries.clear()
+            self._versions = None
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
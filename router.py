@@ -0,0 +1,72 @@
+import re
+from collections import namedtuple
+
+# name: used in logs/metrics, func: called as func(user_id, user_name, text, *groups)
+Command = namedtuple('Command', ['name', 'func', 'admin'])
+
+class CommandRouter:
+    """
+    Compiled command dispatcher.
+
+    Exact keywords are resolved with one dict lookup on the lower-cased text.
+    Parameterised commands are joined, in registration order, into a single
+    precompiled alternation regex (case-insensitive, matched at the start of
+    the original text so captured IDs keep their case).
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._patterns = []
+        self._regex = None
+        self._groups = {}
+
+    def keywords(self, name, words, func, admin=False):
+        """Register a command triggered by any of the exact (case-insensitive) words."""
+        command = Command(name, func, admin)
+        for word in words:
+            self._exact[word.lower()] = command
+        return command
+
+    def pattern(self, name, regex, func, admin=False):
+        """
+        Register a command triggered by a regex matched at the start of the message.
+        Capturing groups in regex are passed to func as extra arguments.
+        """
+        command = Command(name, func, admin)
+        self._patterns.append((regex, command))
+        self._regex = None
+        return command
+
+    def compile(self):
+        """Build the alternation regex. Called automatically on first match."""
+        parts = []
+        groups = {}
+        offset = 0
+        for idx, (regex, command) in enumerate(self._patterns):
+            group_name = f"cmd{idx}"
+            n_groups = re.compile(regex).groups
+            # Outer group is offset + 1; the command's own groups follow it
+            groups[group_name] = (command, tuple(range(offset + 2, offset + 2 + n_groups)))
+            parts.append(f"(?P<{group_name}>{regex})")
+            offset += 1 + n_groups
+        self._groups = groups
+        self._regex = re.compile('|'.join(parts) or r'(?!)', re.IGNORECASE | re.DOTALL)
+        return self._regex
+
+    def match(self, text):
+        """
+        Find the command for a message.
+
+        Returns:
+            (Command, args tuple), or (None, ()) if nothing matches
+        """
+        command = self._exact.get(text.lower())
+        if command is not None:
+            return command, ()
+
+        regex = self._regex or self.compile()
+        m = regex.match(text)
+        if m is None:
+            return None, ()
+        command, indexes = self._groups[m.lastgroup]
+        return command, tuple(map(m.group, indexes))
@@ -0,0 +1,30 @@
+import logging
+import signal
+import threading
+
+import app
+
+def main():
+    """
+    Standalone scheduler process (use with SCHEDULER_MODE=standalone for the web workers).
+    Still takes the scheduler lock, so a second copy just waits as a hot standby.
+    """
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    if not app.scheduler_election.is_leader:
+        app.scheduler_election.start()
+    logging.info("Scheduler process running")
+
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.scheduler_election.stop()
+        app.messenger.stop()
+        if app.scheduler.running:
+            app.scheduler.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,10 @@ import logging
 from datetime import datetime
 import time
 import re
+from urllib.parse import urlsplit
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+import config
+from metrics import RATE_FETCH_SECONDS, RATE_FETCH_TOTAL
 
 # Headers to mimic a real browser
 HEADERS = {
@@ -16,11 +17,18 @@ HEADERS = {
     'Accept-Language': 'en-US,en;q=0.9,th;q=0.8,zh-CN;q=0.7',
 }
 
+def provider_url(url):
+    """url, or the same path on RATE_PROVIDER_BASE_URL when a stand-in is configured."""
+    if not config.RATE_PROVIDER_BASE_URL:
+        return url
+    parts = urlsplit(url)
+    return config.RATE_PROVIDER_BASE_URL + parts.path + (f'?{parts.query}' if parts.query else '')
+
 def get_google_rates():
     """Scrapes CNY/THB rate from Google Finance."""
     url = "https://www.google.com/finance/quote/CNY-THB?hl=en"
     try:
-        response = requests.get(url, headers=HEADERS, timeout=15)
+        response = requests.get(provider_url(url), headers=HEADERS, timeout=15)
         if response.status_code == 200:
             soup = BeautifulSoup(response.text, 'html.parser')
             price_element = soup.select_one('[data-last-price]')
@@ -43,7 +51,7 @@ def get_yahoo_rates():
     """Fetches CNY/THB rate from Yahoo Finance Chart API."""
     url = "https://query1.finance.yahoo.com/v8/finance/chart/CNYTHB=X?interval=1m&range=1d"
     try:
-        response = requests.get(url, headers=HEADERS, timeout=15)
+        response = requests.get(provider_url(url), headers=HEADERS, timeout=15)
         if response.status_code == 200:
             data = response.json()
             rate = data['chart']['result'][0]['meta']['regularMarketPrice']
@@ -62,7 +70,7 @@ def get_boc_th_rates():
     """Scrapes CNY/THB rate from Bank of China Thailand (Official Source)."""
     url = "https://www.bankofchina.com/sourcedb/thb/"
     try:
-        response = requests.get(url, headers=HEADERS, timeout=15)
+        response = requests.get(provider_url(url), headers=HEADERS, timeout=15)
         if response.status_code == 200:
             soup = BeautifulSoup(response.text, 'html.parser')
             table = soup.find('table', class_='data2')
@@ -85,7 +93,7 @@ def get_open_api_rate():
     """Stable Open API rate (International Mid-rate)."""
     url = "https://open.er-api.com/v6/latest/CNY"
     try:
-        response = requests.get(url, timeout=10)
+        response = requests.get(provider_url(url), timeout=10)
         if response.status_code == 200:
             data = response.json()
             rate = float(data['rates']['THB'])
@@ -129,16 +137,27 @@ def fetch_all_rates(include_all=False):
     ]
     
     for scraper_func in scrapers:
+        name = scraper_func.__name__
+        start = time.perf_counter()
         try:
-            results.append(scraper_func())
-            time.sleep(0.5) # Be gentle
+            result = scraper_func()
+            RATE_FETCH_TOTAL.inc(name, result.get('status', 'error'))
+            results.append(result)
         except Exception as e:
-            logging.error(f"Failed in {scraper_func.__name__}: {e}")
+            RATE_FETCH_TOTAL.inc(name, 'exception')
+            logging.error(f"Failed in {name}: {e}")
+            continue
+        finally:
+            RATE_FETCH_SECONDS.observe(time.perf_counter() - start, name)
+        time.sleep(0.5) # Be gentle
     
     logging.info(f"Successfully fetched {len(results)} reliable rate sources")
     return results
 
 if __name__ == "__main__":
+    from log_config import configure_logging
+    configure_logging()
+    
     rates = fetch_all_rates()
     for r in rates:
         print(f"{r['provider']}: {r.get('buying_tt')} / {r.get('selling_tt')} [{r['status']}]")
@@ -0,0 +1,248 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from types import MappingProxyType
+
+from calculator import filter_public_rates, sort_for_display, find_best_rate
+from custom_rate import get_custom_rate
+from database import get_db, get_latest_rates
+from pricing import compile_tiers
+import config
+
+class RateSnapshot:
+    """
+    Immutable, precomputed view of the rates published by one refresh.
+
+    Everything request handlers need (public rates, display order, market best,
+    custom rate and its compiled amount tiers) is computed once here, so
+    handlers only read attributes.
+    Rate dicts are wrapped in read-only mappings.
+
+    version counts snapshots installed in this process (rates or custom rate
+    changed); rates_version is the shared-store version, equal across workers.
+    stale is True for data restored at startup until a refresh replaces it.
+    """
+    __slots__ = (
+        'version', 'rates_version', 'rates', 'by_provider', 'public_rates', 'display_rates',
+        'best_buy', 'best_sell', 'custom_rate', 'custom_version', 'tier_table', 'created_at', 'stale'
+    )
+
+    def __init__(self, version, rates, custom_rate=None, created_at=None, rates_version=0, stale=False):
+        frozen_rates = tuple(MappingProxyType(dict(r)) for r in rates)
+        frozen_custom = MappingProxyType(dict(custom_rate)) if custom_rate else None
+        public_rates = tuple(filter_public_rates(frozen_rates))
+
+        comparison_list = list(public_rates)
+        if frozen_custom and frozen_custom.get('status') == 'custom':
+            comparison_list.insert(0, frozen_custom)
+
+        values = {
+            'version': version,
+            'rates_version': rates_version,
+            'rates': frozen_rates,
+            'by_provider': MappingProxyType({r['provider']: r for r in frozen_rates}),
+            'public_rates': public_rates,
+            'display_rates': tuple(sort_for_display(comparison_list)),
+            'best_buy': find_best_rate(public_rates, 'buying_tt'),
+            'best_sell': find_best_rate(public_rates, 'selling_tt'),
+            'custom_rate': frozen_custom,
+            'custom_version': frozen_custom.get('version', 0) if frozen_custom else 0,
+            'tier_table': compile_tiers(frozen_custom.get('tiers') if frozen_custom else None),
+            'created_at': created_at if created_at is not None else time.time(),
+            'stale': stale
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RateSnapshot is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("RateSnapshot is immutable")
+
+    def __repr__(self):
+        stale = " stale" if self.stale else ""
+        return f"<RateSnapshot v{self.version} rates={len(self.rates)} custom=v{self.custom_version}{stale}>"
+
+    def get_provider(self, provider):
+        """Get the rate for a provider by name, or None."""
+        return self.by_provider.get(provider)
+
+    def age(self):
+        """Seconds since these rates were fetched."""
+        return time.time() - self.created_at
+
+    def is_empty(self):
+        """True until the first rate refresh has been published."""
+        return not self.rates
+
+# Publishers take the lock; readers just read _current, which is swapped atomically
+_publish_lock = threading.Lock()
+_current = RateSnapshot(0, ())
+
+# Only one reader thread at a time checks the shared store; the others keep serving _current
+_poll_lock = threading.Lock()
+_last_poll = float('-inf')
+
+def get_snapshot():
+    """
+    Get the current rate snapshot. Never blocks.
+
+    Every SNAPSHOT_POLL_SECONDS one caller also checks the shared store for
+    a newer snapshot published by another worker process.
+    """
+    if time.monotonic() - _last_poll >= config.SNAPSHOT_POLL_SECONDS:
+        _poll_shared_store()
+    return _current
+
+def sync_with_store():
+    """Check the shared store now instead of waiting for the next poll."""
+    _poll_shared_store()
+    return _current
+
+def _poll_shared_store():
+    """Load rates or the custom rate from SQLite if another process published newer ones."""
+    global _current, _last_poll
+    if not _poll_lock.acquire(blocking=False):
+        return
+    try:
+        _last_poll = time.monotonic()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT (SELECT version FROM rate_snapshot WHERE id = 1),
+                       (SELECT MAX(version) FROM custom_rate_history)
+            ''')
+            rates_version, custom_version = cursor.fetchone()
+            rates_version = rates_version or 0
+            custom_version = custom_version or 0
+
+            current = _current
+            if rates_version == current.rates_version and custom_version == current.custom_version:
+                return
+
+            rates, created_at = current.rates, current.created_at
+            if rates_version != current.rates_version:
+                cursor.execute('SELECT rates, created_at FROM rate_snapshot WHERE id = 1')
+                row = cursor.fetchone()
+                rates, created_at = json.loads(row['rates']), row['created_at']
+
+        custom_rate = None
+        if custom_version != current.custom_version:
+            custom_rate = get_custom_rate()
+
+        with _publish_lock:
+            # A local publish or custom rate change may have landed since `current`
+            # was read: rebuild from the latest snapshot and keep whichever side is newer
+            latest = _current
+            new_rates = rates_version > latest.rates_version
+            new_custom = custom_version > latest.custom_version
+            if not new_rates and not new_custom:
+                return
+            _current = RateSnapshot(
+                latest.version + 1,
+                rates if new_rates else latest.rates,
+                custom_rate if new_custom else latest.custom_rate,
+                created_at if new_rates else latest.created_at,
+                rates_version if new_rates else latest.rates_version,
+                # New rates from another worker are fresh; a custom rate change keeps the flag
+                latest.stale and not new_rates
+            )
+    except (sqlite3.Error, ValueError, TypeError) as e:
+        logging.error(f"Failed to read shared rate snapshot: {e}")
+    finally:
+        _poll_lock.release()
+
+def _store_rates(rates, created_at):
+    """Write rates to the shared store and return the new shared version."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO rate_snapshot (id, version, rates, created_at)
+            VALUES (1, 1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                version = version + 1,
+                rates = excluded.rates,
+                created_at = excluded.created_at
+        ''', (json.dumps([dict(r) for r in rates], ensure_ascii=False), created_at))
+        cursor.execute('SELECT version FROM rate_snapshot WHERE id = 1')
+        version = cursor.fetchone()[0]
+        conn.commit()
+        return version
+
+def publish(rates, custom_rate=None):
+    """
+    Publish a new snapshot after a rate refresh.
+    The rates are also written to the shared store so other workers pick them up.
+
+    Args:
+        rates: List of rate dictionaries from fetch_all_rates
+        custom_rate: Current custom rate dictionary (optional)
+
+    Returns:
+        The new RateSnapshot
+    """
+    global _current
+    created_at = time.time()
+    with _publish_lock:
+        try:
+            rates_version = _store_rates(rates, created_at)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write shared rate snapshot: {e}")
+            rates_version = _current.rates_version
+        _current = RateSnapshot(_current.version + 1, rates, custom_rate, created_at, rates_version)
+        return _current
+
+def replace_custom_rate(custom_rate):
+    """Publish a new snapshot with the same rates and a new custom rate."""
+    global _current
+    with _publish_lock:
+        _current = RateSnapshot(
+            _current.version + 1, _current.rates, custom_rate,
+            _current.created_at, _current.rates_version, _current.stale
+        )
+        return _current
+
+def warm_start():
+    """
+    Install the last persisted rates so the bot can answer immediately after
+    a restart, before the first refresh finishes. Rates older than one
+    refresh interval are marked stale.
+    Uses the shared rate_snapshot row, falling back to rate_history.
+
+    Returns:
+        The restored RateSnapshot, or None if nothing was persisted
+    """
+    global _current, _last_poll
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT version, rates, created_at FROM rate_snapshot WHERE id = 1')
+            row = cursor.fetchone()
+        if row:
+            rates, created_at, rates_version = json.loads(row['rates']), row['created_at'], row['version']
+        else:
+            rates = [dict(r, status='fallback') for r in get_latest_rates()]
+            rates_version = 0
+            # rate_history stores local datetime.now() values
+            created_at = min((datetime.fromisoformat(r['timestamp']).timestamp() for r in rates), default=None)
+        custom_rate = get_custom_rate()
+    except (sqlite3.Error, ValueError) as e:
+        logging.error(f"Warm start failed: {e}")
+        return None
+
+    if not rates:
+        return None
+
+    with _publish_lock:
+        if not _current.is_empty():
+            return _current
+        # A worker joining a live leader restores fresh data; only flag data older than one refresh
+        stale = created_at is None or time.time() - created_at > config.RATE_UPDATE_INTERVAL * 60
+        _current = RateSnapshot(_current.version + 1, rates, custom_rate, created_at, rates_version, stale)
+        _last_poll = time.monotonic()
+        logging.info(f"Warm start: serving {len(rates)} persisted rates until the first refresh")
+        return _current
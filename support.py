@@ -0,0 +1,76 @@
+import time
+
+from database import get_db
+from metrics import timed, DB_QUERY_SECONDS
+
+# Follow-ups stop being folded into a request once its text is this long (LINE allows 5,000)
+MAX_CONTENT_LENGTH = 2000
+
+@timed(DB_QUERY_SECONDS)
+def record_support_request(user_id, content, dedupe_seconds=300):
+    """
+    Record a human support request. Further messages from the same user
+    within dedupe_seconds of it are follow-ups: their text is appended to
+    that request (repeats are dropped) instead of starting a new one.
+    Checked atomically across workers.
+
+    Returns:
+        (request_id, follow_up). request_id is the earlier request's ID for a follow-up.
+    """
+    now = time.time()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        # Take the write lock before checking, so two workers cannot both insert
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT request_id, content FROM support_requests
+            WHERE user_id = ? AND created_at > ?
+            ORDER BY request_id DESC LIMIT 1
+        ''', (user_id, now - dedupe_seconds))
+        existing = cursor.fetchone()
+        if existing:
+            combined = f"{existing['content']}\n{content}"
+            if content not in existing['content'].split('\n') and len(combined) <= MAX_CONTENT_LENGTH:
+                cursor.execute('UPDATE support_requests SET content = ? WHERE request_id = ?',
+                               (combined, existing['request_id']))
+            conn.commit()
+            return existing['request_id'], True
+
+        cursor.execute('''
+            INSERT INTO support_requests (user_id, content, created_at)
+            VALUES (?, ?, ?)
+        ''', (user_id, content, now))
+        conn.commit()
+        return cursor.lastrowid, False
+
+@timed(DB_QUERY_SECONDS)
+def get_support_request_content(request_id):
+    """The text of a support request, follow-ups included (None if unknown)."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT content FROM support_requests WHERE request_id = ?', (request_id,))
+        row = cursor.fetchone()
+        return row['content'] if row else None
+
+@timed(DB_QUERY_SECONDS)
+def attach_delivery(request_id, message_id):
+    """Link a support request to the outbox message relaying it."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE support_requests SET message_id = ? WHERE request_id = ?', (message_id, request_id))
+        conn.commit()
+
+@timed(DB_QUERY_SECONDS)
+def get_recent_support_requests(limit=10):
+    """Latest support requests with the delivery status of their relay (pending, sent, failed...)."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT s.request_id, s.user_id, s.content, s.created_at,
+                   o.status AS delivery_status, o.attempts, o.last_error
+            FROM support_requests s
+            LEFT JOIN outbox o ON o.message_id = s.message_id
+            ORDER BY s.request_id DESC
+            LIMIT ?
+        ''', (limit,))
+        return [dict(row) for row in cursor.fetchall()]
@@ -0,0 +1,27 @@
+import threading
+
+from alerts import check_alerts_and_notify, create_alert
+from database import init_database
+
+RATES = [{'provider': 'Google财经', 'buying_tt': 4.6, 'selling_tt': 4.6, 'status': 'success'}]
+
+def test_concurrent_checks_notify_each_alert_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    for i in range(20):
+        create_alert(f"user{i}", f"User {i}", 4.5, 'above')
+
+    # Several workers checking the same alerts at once, as after 设置汇率 during a scheduled check
+    barrier = threading.Barrier(6)
+    notified = []
+
+    def check():
+        barrier.wait()
+        notified.extend(n['user_id'] for n in check_alerts_and_notify(RATES))
+
+    threads = [threading.Thread(target=check) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(notified) == sorted(f"user{i}" for i in range(20))
@@ -0,0 +1,17 @@
+import log_config
+from log_config import RateLimiter
+
+def test_rate_limiter_forgets_expired_keys(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(log_config.time, 'monotonic', lambda: clock[0])
+    limiter = RateLimiter(60)
+    assert all(limiter.allow(f"user{i}") for i in range(1000))
+    assert not limiter.allow('user0')
+
+    clock[0] += 30
+    assert limiter.allow('late')
+    clock[0] += 31
+    # user0..user999 expired and were dropped; 'late' is still limited
+    assert limiter.allow('user0')
+    assert not limiter.allow('late')
+    assert len(limiter._last) == 2
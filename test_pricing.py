@@ -0,0 +1,16 @@
+import pytest
+
+from pricing import parse_tiers
+
+def test_parse_tiers():
+    assert parse_tiers("50000:0.05/-0.03，10000:0.02") == [
+        {'min_amount': 10000.0, 'buy_adj': 0.02, 'sell_adj': -0.02},
+        {'min_amount': 50000.0, 'buy_adj': 0.05, 'sell_adj': -0.03}
+    ]
+
+@pytest.mark.parametrize('text', [
+    '10000:nan', '10000:inf', '10000:0.02/nan', '10000:0.02/-inf', 'nan:0.02', 'inf:0.02'
+])
+def test_parse_tiers_rejects_non_finite(text):
+    with pytest.raises(ValueError):
+        parse_tiers(text)
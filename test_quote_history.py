@@ -0,0 +1,77 @@
+import sys
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from quote_history import QuoteHistory
+
+def minutes_ago(minutes):
+    return (datetime.now() - timedelta(minutes=minutes)).replace(microsecond=0)
+
+def seeded_history(capacity):
+    """Provider A quoted every minute for the last 10 minutes, B only twice."""
+    rows = [
+        {'provider': 'A', 'timestamp': minutes_ago(m).isoformat(), 'buying_tt': 4.5 + m / 1000, 'selling_tt': None}
+        for m in range(10, 0, -1)
+    ]
+    rows += [
+        {'provider': 'B', 'timestamp': minutes_ago(m).isoformat(), 'buying_tt': 4.4, 'selling_tt': 4.6}
+        for m in (9, 2)
+    ]
+    rows.sort(key=lambda row: row['timestamp'])
+    history = QuoteHistory(capacity=capacity, days=1)
+    history.seed(lambda since: rows)
+    return history
+
+def test_wrapped_ring_does_not_cover_overwritten_quotes():
+    history = seeded_history(capacity=5)
+    ring = history.ring('A')
+    assert len(ring) == ring.capacity
+    assert ring.oldest()[0] == minutes_ago(5).timestamp()
+
+    # The ring wrapped: minutes 10 to 6 were overwritten
+    assert history.covers(minutes_ago(3).timestamp())
+    assert not history.covers(minutes_ago(8).timestamp())
+    assert not history.covers(minutes_ago(5).timestamp())
+    assert not history.covers(minutes_ago(8).timestamp(), ['A'])
+
+    # B never filled its ring, so nothing of it was lost
+    assert history.covers(minutes_ago(8).timestamp(), ['B'])
+    assert list(history.ring('B').window(minutes_ago(8).timestamp())[1]) == [4.4]
+
+def test_covers_within_retained_days_only():
+    history = seeded_history(capacity=100)
+    assert history.covers(minutes_ago(60).timestamp())
+    assert not history.covers((datetime.now() - timedelta(days=2)).timestamp())
+
+def test_window_columns_stay_aligned_during_sync():
+    # Switch threads as often as possible, so a sync lands between column copies
+    previous = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    history = QuoteHistory(capacity=64, days=1)
+    start = datetime.now().timestamp() - 3600
+    stop = threading.Event()
+
+    def publish():
+        version = 0
+        while not stop.is_set():
+            version += 1
+            # Rates encode their own timestamp, so a shifted column shows up as a mismatch
+            history.sync(SimpleNamespace(
+                rates_version=version, created_at=start + version, is_empty=lambda: False,
+                rates=[{'provider': 'A', 'status': 'success', 'buying_tt': version, 'selling_tt': -version}]
+            ))
+
+    writer = threading.Thread(target=publish)
+    writer.start()
+    try:
+        for _ in range(10000):
+            columns = history.window('A')
+            if columns is None:
+                continue
+            timestamps, buying, selling = columns
+            assert [t - int(start) for t in timestamps] == [int(b) for b in buying] == [-int(s) for s in selling]
+    finally:
+        stop.set()
+        writer.join()
+        sys.setswitchinterval(previous)
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from quotes import QuoteError, price_sheet_amounts
+
+@pytest.mark.parametrize('start, stop, step', [
+    (1000, float('nan'), 1000),
+    (1000, float('inf'), 1000),
+    (1000, 100000, float('nan')),
+    (1000, 100000, float('inf')),
+    (float('nan'), 100000, 1000),
+    (float('-inf'), 100000, 1000),
+])
+def test_price_sheet_rejects_non_finite(start, stop, step):
+    with pytest.raises(QuoteError):
+        price_sheet_amounts(start, stop, step)
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    """The Flask app on a scratch database, without background jobs, with one snapshot published."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(tmp_path_factory.mktemp('quotes'))
+        mp.setenv('SCHEDULER_MODE', 'off')
+        import config
+        # config may already have been imported by another test module
+        mp.setattr(config, 'SCHEDULER_MODE', 'off')
+        import app
+        from snapshot import publish
+        publish([{'provider': 'Google财经', 'buying_tt': 4.5, 'selling_tt': 4.5, 'status': 'success', 'timestamp': 'x'}])
+        yield app.app.test_client()
+
+@pytest.mark.parametrize('query', ['stop=nan', 'stop=inf', 'step=nan', 'start=-inf'])
+def test_quote_endpoints_reject_non_finite(client, query):
+    assert client.get(f'/api/quote?{query}').status_code == 400
+    assert client.get(f'/api/quote.csv?{query}').status_code == 400
+
+def test_quote_rejects_non_object_body(client):
+    response = client.post('/api/quote', json=[1, 2])
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_public_quote_size_is_capped(client, monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'QUOTE_PUBLIC_MAX_AMOUNTS', 2000)
+    monkeypatch.setattr(config, 'ADMIN_API_TOKEN', 'secret')
+    sheet = '/api/quote?start=1&stop=100000&step=1'
+    assert client.get(sheet).status_code == 400
+    assert client.get('/api/quote.csv?start=1&stop=100000&step=1').status_code == 400
+    assert client.post('/api/quote', json={'amounts': [1000] * 2001}).status_code == 400
+    assert client.get('/api/quote?start=1&stop=2000&step=1').status_code == 200
+    assert client.get(sheet, headers={'Authorization': 'Bearer wrong'}).status_code == 400
+    assert client.get(sheet, headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+def test_empty_admin_token_does_not_lift_the_cap(client, monkeypatch):
+    import config
+    monkeypatch.setattr(config, 'ADMIN_API_TOKEN', '')
+    response = client.get('/api/quote?start=1&stop=100000&step=1', headers={'Authorization': 'Bearer '})
+    assert response.status_code == 400
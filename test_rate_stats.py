@@ -0,0 +1,56 @@
+import math
+import random
+
+import pytest
+
+from rate_stats import RollingWindow
+
+def naive_percentile(window, value):
+    below = sum(1 for sample in window if sample < value)
+    equal = sum(1 for sample in window if sample == value)
+    return 100.0 * (below + 0.5 * equal) / len(window)
+
+@pytest.mark.parametrize('size', [1, 5, 300])
+def test_percentile_matches_sorted_window(size):
+    rng = random.Random(size)
+    # One sample a minute, a window of `size` minutes
+    rolling, samples = RollingWindow(size * 60, 600, size + 1), []
+    rate = 4.5
+    for i in range(2000):
+        # Rates quoted to 4 decimals, drifting, with occasional jumps that move the buckets
+        rate = max(0.5, rate + rng.gauss(0, 0.002) + (0.3 if i % 500 == 499 else 0))
+        value = round(rate, 4)
+        rolling.add(i * 60, value)
+        samples.append(value)
+        window = samples[-size:]
+        assert rolling.count == len(window)
+        for probe in (value, window[0], round(value + 0.0001, 4), 0.1, 100.0):
+            assert rolling.percentile(probe) == pytest.approx(naive_percentile(window, probe))
+
+def test_window_is_bounded_by_time_not_samples():
+    hour = 3600
+    rolling = RollingWindow(24 * hour, 6 * hour, capacity=24 * 60 + 1)
+    # A busy hour of on-demand refreshes every minute, then hourly ticks only
+    timestamps = [i * 60 for i in range(60)] + [hour * h for h in range(2, 49)]
+    rates = {t: 4.5 + (t % 7) / 1000 for t in timestamps}
+    for t in timestamps:
+        rolling.add(t, rates[t])
+    window = [rates[t] for t in timestamps if t > 48 * hour - 24 * hour]
+    assert rolling.count == len(window) == 24
+    assert (rolling.minimum, rolling.maximum) == (min(window), max(window))
+    assert rolling.percentile() == pytest.approx(naive_percentile(window, rates[48 * hour]))
+
+    # Nothing new for a day: everything expires
+    rolling.expire(73 * hour)
+    assert rolling.count == 0 and rolling.minimum is None
+
+def test_ewma_decays_by_elapsed_time():
+    steady = RollingWindow(86400, 3600, 1000)
+    steady.add(0, 4.0)
+    steady.add(60, 5.0)
+    sparse = RollingWindow(86400, 3600, 1000)
+    sparse.add(0, 4.0)
+    sparse.add(6 * 3600, 5.0)
+    assert steady.ewma == pytest.approx(4.0 + (1 - math.exp(-2 * 60 / 3600)))
+    # Six spans later the old level has all but gone
+    assert sparse.ewma == pytest.approx(5.0, abs=1e-4)
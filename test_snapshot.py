@@ -0,0 +1,24 @@
+import custom_rate
+import snapshot
+from database import init_database
+
+def test_poll_keeps_a_newer_local_custom_rate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # This process must not hear about the other worker's save (app registers a listener)
+    monkeypatch.setattr(custom_rate, '_change_listeners', [])
+    init_database()
+    snapshot.publish([{'provider': 'A', 'buying_tt': 4.5, 'selling_tt': 4.6, 'status': 'success'}])
+    custom_rate.set_custom_rate(4.50)  # saved by another worker, not yet seen here
+
+    read_custom_rate = snapshot.get_custom_rate
+
+    def custom_rate_changed_meanwhile():
+        # The poll has read the store; a local admin change lands before it swaps in
+        stored = read_custom_rate()
+        snapshot.replace_custom_rate(custom_rate.set_custom_rate(4.70))
+        return stored
+
+    monkeypatch.setattr(snapshot, 'get_custom_rate', custom_rate_changed_meanwhile)
+    current = snapshot.sync_with_store()
+    assert current.custom_rate['buying_tt'] == 4.70
+    assert current.custom_version == 2
@@ -0,0 +1,17 @@
+from database import init_database
+from support import get_support_request_content, record_support_request
+
+def test_follow_ups_fold_into_the_first_request(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    request_id, follow_up = record_support_request('U1', '人工 换汇', 300)
+    assert not follow_up
+
+    # Different text, the same text again: neither starts a new relay
+    assert record_support_request('U1', '人工 我要换5万', 300) == (request_id, True)
+    assert record_support_request('U1', '人工 换汇', 300) == (request_id, True)
+    assert get_support_request_content(request_id) == '人工 换汇\n人工 我要换5万'
+
+    # Other users are independent, and the window ends
+    assert record_support_request('U2', '人工 换汇', 300)[1] is False
+    assert record_support_request('U1', '人工 还在吗', 0)[1] is False